@@ -0,0 +1,163 @@
+import time
+import heapq
+import asyncio
+import itertools
+import contextlib
+import collections
+
+from config import (
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_PAID_CONCURRENCY,
+    ADMISSION_FREE_CONCURRENCY,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_PRIORITY_TTL_SECONDS,
+)
+
+# Lower number = served first.
+PRIORITY_CLASSES = {"paid": 0, "free": 1}
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being sent upstream."""
+    pass
+
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of the upstream (Gemini) call.
+
+    Users with a completed payment are in the "paid" class and are always served before
+    "free" users. Each class has its own concurrency cap under a global one, so free traffic
+    can never take every slot. When the queue is full, a paid request pushes out the newest
+    free waiter; anything that can't get a slot in time is shed with Overloaded.
+    """
+
+    def __init__(self, storage, max_concurrency=ADMISSION_MAX_CONCURRENCY, class_limits=None,
+                 queue_size=ADMISSION_QUEUE_SIZE, max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS,
+                 priority_ttl_seconds=ADMISSION_PRIORITY_TTL_SECONDS):
+        self.storage = storage
+        self.max_concurrency = max_concurrency
+        self.class_limits = class_limits or {"paid": ADMISSION_PAID_CONCURRENCY, "free": ADMISSION_FREE_CONCURRENCY}
+        self.queue_size = queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self.priority_ttl_seconds = priority_ttl_seconds
+        self._waiting = []  # heap of [priority, seq, class_name, future]
+        self._sequence = itertools.count()
+        self._active = {name: 0 for name in PRIORITY_CLASSES}
+        self._priority_cache = {}  # user_id -> (class_name, expires_at)
+        self._next_prune = time.monotonic() + priority_ttl_seconds
+        self._counters = collections.Counter()
+        self._wait_seconds = {name: 0.0 for name in PRIORITY_CLASSES}
+
+    def class_for(self, user_id):
+        now = time.monotonic()
+        cached = self._priority_cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        if now >= self._next_prune:
+            # Once per TTL, so the cache only holds users seen in the last two TTLs.
+            self._priority_cache = {key: value for key, value in self._priority_cache.items() if value[1] > now}
+            self._next_prune = now + self.priority_ttl_seconds
+        class_name = "paid" if self.storage.has_completed_payment(user_id) else "free"
+        self._priority_cache[user_id] = (class_name, now + self.priority_ttl_seconds)
+        return class_name
+
+    def _has_capacity(self, class_name):
+        return (sum(self._active.values()) < self.max_concurrency
+                and self._active[class_name] < self.class_limits[class_name])
+
+    def _dispatch(self):
+        """Hands free slots to waiters in priority order, skipping classes that are at their cap."""
+        blocked = []
+        while self._waiting:
+            entry = heapq.heappop(self._waiting)
+            _, _, class_name, future = entry
+            if future.done():
+                continue
+            if self._has_capacity(class_name):
+                self._active[class_name] += 1
+                future.set_result(None)
+            else:
+                blocked.append(entry)
+        for entry in blocked:
+            heapq.heappush(self._waiting, entry)
+
+    def _remove_waiter(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    def _make_room(self, priority):
+        """Sheds the newest waiter of a lower priority than `priority`. Returns False if there is none."""
+        victims = [entry for entry in self._waiting if entry[0] > priority]
+        if not victims:
+            return False
+        victim = max(victims)
+        self._remove_waiter(victim)
+        victim[3].set_exception(Overloaded("pushed out by a higher priority request"))
+        return True
+
+    async def _wait_for_slot(self, class_name):
+        priority = PRIORITY_CLASSES[class_name]
+        if len(self._waiting) >= self.queue_size and not self._make_room(priority):
+            raise Overloaded("admission queue is full")
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), class_name, future]
+        heapq.heappush(self._waiting, entry)
+        try:
+            # Not wait_for: it swallows a cancellation that arrives together with the slot.
+            done, _ = await asyncio.wait({future}, timeout=self.max_wait_seconds)
+        except asyncio.CancelledError:
+            if future.done() and not future.exception():
+                self._release(class_name)
+            elif entry in self._waiting:
+                self._remove_waiter(entry)
+            raise
+        if not done:
+            self._remove_waiter(entry)
+            future.cancel()
+            raise Overloaded("timed out waiting for a slot")
+        future.result()  # raises Overloaded if a higher priority request pushed us out
+
+    def _release(self, class_name):
+        self._active[class_name] -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def admit(self, user_id):
+        """Holds an upstream slot for the body of the `async with`. Raises Overloaded if shed."""
+        class_name = self.class_for(user_id)
+        started = time.monotonic()
+        # Waiters only exist for classes that are at a cap, so free capacity means nobody is ahead of us.
+        if self._has_capacity(class_name):
+            self._active[class_name] += 1
+        else:
+            try:
+                await self._wait_for_slot(class_name)
+            except Overloaded:
+                self._counters[f"{class_name}_shed"] += 1
+                raise
+        self._counters[f"{class_name}_admitted"] += 1
+        self._wait_seconds[class_name] += time.monotonic() - started
+        try:
+            yield
+        finally:
+            self._release(class_name)
+
+    def metrics(self):
+        """Current queue state and counters since startup, per priority class."""
+        waiting = collections.Counter(entry[2] for entry in self._waiting)
+        snapshot = {}
+        for class_name in PRIORITY_CLASSES:
+            admitted = self._counters[f"{class_name}_admitted"]
+            snapshot[class_name] = {
+                "active": self._active[class_name],
+                "limit": self.class_limits[class_name],
+                "waiting": waiting[class_name],
+                "admitted": admitted,
+                "shed": self._counters[f"{class_name}_shed"],
+                "avg_wait_seconds": round(self._wait_seconds[class_name] / admitted, 3) if admitted else 0.0,
+            }
+        snapshot["queue_size"] = self.queue_size
+        snapshot["max_concurrency"] = self.max_concurrency
+        return snapshot
@@ -0,0 +1,258 @@
+import os
+import sys
+import sqlite3
+import argparse
+import datetime
+import tempfile
+
+from config import ANALYTICS_DATABASE_FILE, ANALYTICS_BATCH_SIZE
+from budget import token_cost
+from database import DATABASE_FILE, DatabaseError
+
+
+def open_source(database_file=DATABASE_FILE, snapshot=False):
+    """
+    Opens the bot database for reading only. Returns (connection, snapshot file or None).
+
+    With `snapshot`, the database is first copied with SQLite's online backup API and the
+    copy is read instead, so the refresh holds no read transaction on the live file at all.
+    """
+    if not os.path.exists(database_file):
+        raise DatabaseError(f"Database file not found: {database_file}. Please run database.py to create it.")
+    source = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+    if not snapshot:
+        return source, None
+    copy_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    copy = sqlite3.connect(copy_file)
+    source.backup(copy)
+    source.close()
+    return copy, copy_file
+
+
+def create_rollup_tables(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS DailyUsage (
+            day TEXT PRIMARY KEY,
+            questions INTEGER,
+            cache_hits INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS DailyActiveUser (
+            day TEXT,
+            user_id TEXT,
+            PRIMARY KEY (day, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS DailyRevenue (
+            day TEXT,
+            plan_id INTEGER,
+            payments INTEGER,
+            revenue DECIMAL,
+            PRIMARY KEY (day, plan_id)
+        );
+        CREATE TABLE IF NOT EXISTS DailyTokenUsage (
+            day TEXT,
+            model TEXT,
+            requests INTEGER,
+            prompt_tokens INTEGER,
+            output_tokens INTEGER,
+            PRIMARY KEY (day, model)
+        );
+        CREATE TABLE IF NOT EXISTS Watermark (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER,
+            last_value TEXT
+        );
+    ''')
+
+
+def utc_day(timestamp):
+    """
+    The UTC date of an ISO timestamp, so every rollup uses the same days. Naive timestamps,
+    like Payment.completed_at, are in the bot server's local time.
+    """
+    if not timestamp:
+        return ""
+    moment = datetime.datetime.fromisoformat(timestamp)
+    return moment.astimezone(datetime.timezone.utc).date().isoformat()
+
+
+def _get_watermark(conn, source):
+    row = conn.execute("SELECT last_id, last_value FROM Watermark WHERE source = ?", (source,)).fetchone()
+    return row if row else (0, "")
+
+
+def _set_watermark(conn, source, last_id, last_value=""):
+    conn.execute('''
+        INSERT INTO Watermark (source, last_id, last_value) VALUES (?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET last_id = excluded.last_id, last_value = excluded.last_value
+    ''', (source, last_id, last_value))
+
+
+def _roll_up_messages(source, target):
+    """Folds messages newer than the watermark into DailyUsage and DailyActiveUser."""
+    last_id, _ = _get_watermark(target, "Message")
+    count = 0
+    while True:
+        # message_id is the rowid, so this is a range read on the primary key, not a table scan.
+        rows = source.execute('''
+            SELECT message_id, user_id, timestamp, cache_hit FROM Message
+            WHERE message_id > ? ORDER BY message_id LIMIT ?
+        ''', (last_id, ANALYTICS_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        usage = {}
+        for message_id, user_id, timestamp, cache_hit in rows:
+            day = utc_day(timestamp)
+            questions, hits = usage.get(day, (0, 0))
+            usage[day] = (questions + 1, hits + (1 if cache_hit else 0))
+            target.execute("INSERT OR IGNORE INTO DailyActiveUser (day, user_id) VALUES (?, ?)", (day, user_id))
+        target.executemany('''
+            INSERT INTO DailyUsage (day, questions, cache_hits) VALUES (?, ?, ?)
+            ON CONFLICT(day) DO UPDATE SET questions = questions + excluded.questions,
+                                           cache_hits = cache_hits + excluded.cache_hits
+        ''', [(day, questions, hits) for day, (questions, hits) in usage.items()])
+        last_id = rows[-1][0]
+        # Rollups and watermark commit together, so a crash never counts a batch twice.
+        _set_watermark(target, "Message", last_id)
+        target.commit()
+        count += len(rows)
+    return count
+
+
+def _roll_up_payments(source, target):
+    """Folds payments completed after the watermark into DailyRevenue."""
+    last_id, last_completed_at = _get_watermark(target, "Payment")
+    count = 0
+    while True:
+        # Payments are created pending and complete later, so the watermark follows
+        # (completed_at, payment_id) rather than payment_id alone. completed_at stays in
+        # local time in the bot database so that this order holds across old and new rows.
+        rows = source.execute('''
+            SELECT payment_id, plan_id, amount, completed_at FROM Payment
+            WHERE payment_status = 'completed'
+              AND (completed_at > ? OR (completed_at = ? AND payment_id > ?))
+            ORDER BY completed_at, payment_id LIMIT ?
+        ''', (last_completed_at, last_completed_at, last_id, ANALYTICS_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        revenue = {}
+        for payment_id, plan_id, amount, completed_at in rows:
+            key = (utc_day(completed_at), plan_id)
+            payments, total = revenue.get(key, (0, 0))
+            revenue[key] = (payments + 1, total + (amount or 0))
+        target.executemany('''
+            INSERT INTO DailyRevenue (day, plan_id, payments, revenue) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, plan_id) DO UPDATE SET payments = payments + excluded.payments,
+                                                    revenue = revenue + excluded.revenue
+        ''', [(day, plan_id, payments, total) for (day, plan_id), (payments, total) in revenue.items()])
+        last_id, last_completed_at = rows[-1][0], rows[-1][3]
+        _set_watermark(target, "Payment", last_id, last_completed_at)
+        target.commit()
+        count += len(rows)
+    return count
+
+
+def _roll_up_model_usage(source, target):
+    """
+    Copies the bot's per-day ModelUsage totals into DailyTokenUsage.
+
+    ModelUsage counts every Gemini call, including cache refreshes and answers that came
+    back empty, which have no Message. It is already one row per day and model, so the
+    rows from the last day copied onwards are simply copied again.
+    """
+    _, last_day = _get_watermark(target, "ModelUsage")
+    rows = source.execute('''
+        SELECT day, model, requests, prompt_tokens, output_tokens FROM ModelUsage WHERE day >= ? ORDER BY day
+    ''', (last_day,)).fetchall()
+    if not rows:
+        return 0
+    target.executemany('''
+        INSERT OR REPLACE INTO DailyTokenUsage (day, model, requests, prompt_tokens, output_tokens) VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    _set_watermark(target, "ModelUsage", 0, rows[-1][0])
+    target.commit()
+    return len(rows)
+
+
+def refresh(database_file=DATABASE_FILE, analytics_file=ANALYTICS_DATABASE_FILE, snapshot=False):
+    """Brings the rollup tables up to date. Returns (messages, payments, model usage rows) processed."""
+    source, snapshot_file = open_source(database_file, snapshot)
+    target = sqlite3.connect(analytics_file)
+    try:
+        create_rollup_tables(target)
+        return _roll_up_messages(source, target), _roll_up_payments(source, target), _roll_up_model_usage(source, target)
+    finally:
+        source.close()
+        target.close()
+        if snapshot_file:
+            os.remove(snapshot_file)
+
+
+def report(analytics_file=ANALYTICS_DATABASE_FILE, days=7):
+    """
+    Returns (daily rows, revenue-per-plan rows, token rows per day and model) for the last
+    `days` UTC days from the rollups only. Days with revenue but no questions are included.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    since = (today - datetime.timedelta(days=days - 1)).isoformat()
+    conn = sqlite3.connect(analytics_file)
+    try:
+        create_rollup_tables(conn)
+        daily = conn.execute('''
+            WITH days AS (SELECT day FROM DailyUsage WHERE day >= ? UNION SELECT day FROM DailyRevenue WHERE day >= ?)
+            SELECT d.day, (SELECT COUNT(*) FROM DailyActiveUser a WHERE a.day = d.day),
+                   COALESCE(u.questions, 0), COALESCE(u.cache_hits, 0),
+                   COALESCE((SELECT SUM(revenue) FROM DailyRevenue r WHERE r.day = d.day), 0)
+            FROM days d LEFT JOIN DailyUsage u ON u.day = d.day ORDER BY d.day
+        ''', (since, since)).fetchall()
+        per_plan = conn.execute('''
+            SELECT plan_id, SUM(payments), SUM(revenue) FROM DailyRevenue
+            WHERE day >= ? GROUP BY plan_id ORDER BY SUM(revenue) DESC
+        ''', (since,)).fetchall()
+        token_usage = conn.execute('''
+            SELECT day, model, requests, prompt_tokens, output_tokens FROM DailyTokenUsage
+            WHERE day >= ? ORDER BY day, model
+        ''', (since,)).fetchall()
+        return daily, per_plan, token_usage
+    finally:
+        conn.close()
+
+
+def print_report(days=7):
+    daily, per_plan, token_usage = report(days=days)
+    print(f"{'day':<12}{'active':>8}{'questions':>11}{'cache hit':>11}{'revenue':>12}")
+    for day, active_users, questions, cache_hits, revenue in daily:
+        hit_ratio = cache_hits / questions if questions else 0
+        print(f"{day:<12}{active_users:>8}{questions:>11}{hit_ratio:>10.1%}{revenue:>12.2f}")
+    print()
+    print(f"{'plan':<12}{'payments':>10}{'revenue':>12}")
+    for plan_id, payments, revenue in per_plan:
+        print(f"{plan_id!s:<12}{payments:>10}{revenue:>12.2f}")
+    print()
+    print(f"{'day':<12}{'model':<32}{'requests':>10}{'prompt':>12}{'output':>12}{'cost $':>10}")
+    total_cost = 0.0
+    for day, model, requests, prompt_tokens, output_tokens in token_usage:
+        cost = token_cost(model, prompt_tokens, output_tokens)
+        total_cost += cost
+        print(f"{day:<12}{model:<32}{requests:>10}{prompt_tokens:>12}{output_tokens:>12}{cost:>10.4f}")
+    print(f"{'total':<12}{'':<32}{'':>10}{'':>12}{'':>12}{total_cost:>10.4f}")
+
+
+if __name__ == '__main__':
+    # Run `refresh` from cron (e.g. every few minutes), then `report` whenever needed.
+    parser = argparse.ArgumentParser(description="Usage and revenue rollups.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subcommands.add_parser("refresh", help="update the rollup tables")
+    refresh_parser.add_argument("--snapshot", action="store_true", help="read from a backup copy of the database")
+    report_parser = subcommands.add_parser("report", help="print the rollups")
+    report_parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        try:
+            messages, payments, model_usage = refresh(snapshot=args.snapshot)
+        except (DatabaseError, sqlite3.Error) as e:
+            print(f"Error refreshing analytics: {e}")
+            sys.exit(1)
+        print(f"Rolled up {messages} messages, {payments} payments and {model_usage} model usage rows.")
+    else:
+        print_report(args.days)
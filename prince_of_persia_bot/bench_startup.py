@@ -0,0 +1,72 @@
+"""
+Measures the bot's cold start.
+
+Each run is a fresh Python process in an empty directory (so the database is created and
+migrated from scratch) that times:
+  import   - `import bot`
+  services - init_services(): storage opened, schema checked, caches set up
+  build    - build_application(), which is where python-telegram-bot gets imported
+  ready    - cache warm-up preloaded, i.e. everything before the first getUpdates call
+
+Nothing talks to Telegram; the token is a dummy and HTTP warm-up failures are ignored.
+
+    python bench_startup.py [--runs 10]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = r'''
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, %r)
+import bot
+imported = time.perf_counter()
+bot.init_services()
+services = time.perf_counter()
+application = bot.build_application()
+built = time.perf_counter()
+bot.cache_warmer.preload()
+ready = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "services": services - imported,
+    "build": built - services,
+    "ready": ready - started,
+}))
+'''
+
+STAGES = ("import", "services", "build", "ready")
+
+
+def run_once():
+    env = dict(os.environ, TELEGRAM_API_TOKEN="123456:bench", STORAGE_BACKEND="sqlite",
+               HEALTH_PORT="0", BOT_READY_FILE="")
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD % BOT_DIR],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark.")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    print(f"{'stage':<10}{'median ms':>11}{'min ms':>9}{'max ms':>9}")
+    for stage in STAGES:
+        times = [result[stage] * 1000 for result in results]
+        print(f"{stage:<10}{statistics.median(times):>11.1f}{min(times):>9.1f}{max(times):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
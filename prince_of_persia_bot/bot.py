@@ -1,41 +1,30 @@
-import os
+from __future__ import annotations
+
+import asyncio
 import logging
 import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    ContextTypes,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters,
-)
-from dotenv import load_dotenv
-from database import (
-    add_user,
-    get_user_credits,
-    get_last_message_timestamp,
-    decrement_user_credits,
-    get_cached_response,
-    store_cached_response,
-    add_message,
-    get_all_plans,
-    add_payment,
-    update_payment_status,
-    get_payment_details,
-    get_plan_by_id,
-    add_credits_to_user,
-    get_user_phone_number,
-    update_user_phone_number,
-)
-from gemini_api import get_gemini_response
+import functools
+import threading
+from typing import TYPE_CHECKING
+
+from config import TELEGRAM_API_TOKEN, BOT_CALLBACK_BASE_URL, PROXY_URL, BOT_WORKERS, ADMIN_USER_IDS
+from gemini_api import GEMINI_API_HOST, get_gemini_response, extract_answer_text, extract_usage
 from zarinpal_api import create_payment_request, verify_payment
+from http_client import warm_up
+from storage import get_storage, AlreadyJournaled
+from broadcast import Broadcaster, interactive_traffic
+from admission import AdmissionController, Overloaded
+from cache_warmer import ResponseCache, CacheWarmer
+from readiness import mark_ready, mark_not_ready, start_probe_server
+from lifecycle import Lifecycle
+from dedup import UpdateDeduplicator
+from budget import TokenBudget, BudgetExceeded, today
 
-# Load environment
-load_dotenv()
-TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
-BOT_CALLBACK_BASE_URL = os.getenv("BOT_CALLBACK_BASE_URL", "https://example.com")
-PROXY_URL = os.getenv("PROXY_URL")
+# python-telegram-bot is the slowest import by far; it is loaded in build_application()
+# and inside the handlers, so importing this module stays cheap.
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
 
 # Configure logging
 logging.basicConfig(
@@ -44,35 +33,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Drains in-flight questions on shutdown.
+lifecycle = Lifecycle()
+
+# Created once per process by init_services().
+storage = None
+admission = None
+token_budget = None
+response_cache = None
+cache_warmer = None
+# Only set where updates are fetched: here with run_polling, in the dispatcher with workers.
+update_dedup = None
+
+def init_services():
+    """
+    Opens storage and the services built on it. Safe to call more than once.
+
+    Opening SQLite storage verifies and, if needed, migrates the schema and leaves the
+    connection open for the handlers. The upstream HTTP connection is warmed in the
+    background meanwhile, so it overlaps with the rest of the startup.
+    """
+    global storage, admission, token_budget, response_cache, cache_warmer
+    if storage is not None:
+        return
+    threading.Thread(target=warm_up, args=(GEMINI_API_HOST,), name="http-warm-up", daemon=True).start()
+    # Selected by STORAGE_BACKEND; the SQLite engine is safe to share between worker processes.
+    storage = get_storage()
+    # Paying users get upstream slots first when Gemini slows down.
+    admission = AdmissionController(storage)
+    # Daily token budgets decide the model and answer length of every Gemini call.
+    token_budget = TokenBudget(storage)
+    # Answers are cached per normalized question, with TTLs that grow with popularity.
+    response_cache = ResponseCache(storage, "Gemini")
+    cache_warmer = CacheWarmer(response_cache, fetch_cache_answer, admission)
+
+def call_gemini(user_id, text, plan):
+    """
+    Calls Gemini as planned and records the tokens used. Blocking; the handlers run it in a
+    thread, and recording here counts the call even when the awaiting handler is cancelled.
+    """
+    data = get_gemini_response(text, plan.model, plan.max_output_tokens)
+    if data:
+        # Tokens are spent even if the answer turns out empty (e.g. cut off by the cap).
+        token_budget.record(user_id, plan.model, *extract_usage(data))
+    return data
+
+def fetch_cache_answer(text):
+    """Gemini answer for a cache refresh, or None. Refreshes count towards the global budget and stop when it runs low."""
+    try:
+        plan = token_budget.plan(None, text)
+    except BudgetExceeded:
+        return None
+    if plan.reduced:
+        return None
+    data = call_gemini(None, text, plan)
+    if not data:
+        return None
+    return extract_answer_text(data) or None
+
+def contact_keyboard():
+    from telegram import KeyboardButton, ReplyKeyboardMarkup
+
+    kb = [[KeyboardButton("اشتراک گذاری مخاطب", request_contact=True)]]
+    return ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True)
+
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every other handler and stops redelivered updates before they reach storage or Gemini."""
+    from telegram.ext import ApplicationHandlerStop
+
+    callback_query_id = update.callback_query.id if update.callback_query else None
+    if update_dedup.is_duplicate(update.update_id, callback_query_id):
+        logger.info(f"Dropped duplicate update {update.update_id}")
+        raise ApplicationHandlerStop
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not user:
         return
     user_id = f"{user.id}-0"
     try:
-        add_user(user_id, str(user.id), "Telegram", username=user.username)
+        storage.add_user(user_id, str(user.id), "Telegram", username=user.username)
         logger.info(f"Added or exists user {user_id}")
     except Exception as e:
         logger.error(f"DB error adding user {user_id}: {e}")
 
-    phone = get_user_phone_number(user_id)
+    phone = storage.get_user_phone_number(user_id)
     if phone:
         await update.message.reply_text(f"سلام {user.first_name}! هر سوالی دارید بپرسید.")
     else:
-        kb = [[KeyboardButton("اشتراک گذاری مخاطب", request_contact=True)]]
-        markup = ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True)
         await update.message.reply_text(
             f"خوش آمدید {user.first_name}! لطفا شماره موبایل خود را برای ادامه به اشتراک بگذارید.",
-            reply_markup=markup
+            reply_markup=contact_keyboard()
         )
 
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from telegram import ReplyKeyboardRemove
+
     if not (user := update.effective_user) or not update.message.contact:
         return
     user_id = f"{user.id}-0"
     phone = update.message.contact.phone_number
     try:
-        update_user_phone_number(user_id, phone)
+        storage.update_user_phone_number(user_id, phone)
         logger.info(f"Stored phone for {user_id}: {phone}")
         await update.message.reply_text(
             "متشکرم! اکنون می توانید از ربات استفاده کنید.",
@@ -86,12 +148,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if user:
         user_id = f"{user.id}-0"
-        if not get_user_phone_number(user_id):
-            kb = [[KeyboardButton("اشتراک گذاری مخاطب", request_contact=True)]]
-            markup = ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True)
+        if not storage.get_user_phone_number(user_id):
             await update.message.reply_text(
                 "لطفا شماره موبایل خود را به اشتراک بگذارید.",
-                reply_markup=markup
+                reply_markup=contact_keyboard()
             )
             return
     await update.message.reply_text(
@@ -105,78 +165,147 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user or not update.message.text:
         return
     user_id = f"{user.id}-0"
-    if not get_user_phone_number(user_id):
-        kb = [[KeyboardButton("اشتراک گذاری مخاطب", request_contact=True)]]
-        markup = ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True)
+    if not storage.get_user_phone_number(user_id):
         await update.message.reply_text(
             "لطفا شماره موبایل خود را به اشتراک بگذارید.",
-            reply_markup=markup
+            reply_markup=contact_keyboard()
         )
         return
 
-    now = datetime.datetime.now(datetime.timezone.utc)
     text = update.message.text
 
     # Rate limiting
-    last_ts = get_last_message_timestamp(user_id)
-    if last_ts:
+    if not storage.check_rate_limit(user_id, 10):
+        await update.message.reply_text("لطفا بین ارسال پیام ها ۱۰ ثانیه صبر کنید.")
+        return
+
+    charged = False
+    try:
+        charged = await answer_question(
+            request_id=str(update.update_id),
+            user_id=user_id,
+            chat_id=update.effective_chat.id,
+            text=text,
+            asked_at=update.message.date.isoformat(),
+            send=update.message.reply_text,
+        )
+    finally:
+        if not charged:
+            # Refused, shed or refunded: the user may try again right away.
+            storage.clear_rate_limit(user_id)
+
+async def answer_question(request_id, user_id, chat_id, text, asked_at, send):
+    """
+    Charges a credit, answers `text` from the cache or Gemini and records the Message.
+
+    `send(text)` posts a message to the user's chat and returns it. The credit is journaled
+    with the request until the Message is stored; if the shutdown deadline cancels us first,
+    it is refunded and the question is answered again after the next boot.
+
+    Returns True once the question is charged for, False if it ended with the credit
+    refused or refunded.
+    """
+    with lifecycle.track():
+        # Credits check
         try:
-            last = datetime.datetime.fromisoformat(last_ts)
-            if (now - last).total_seconds() < 10:
-                await update.message.reply_text("لطفا بین ارسال پیام ها ۱۰ ثانیه صبر کنید.")
-                return
-        except ValueError:
-            pass
-
-    # Credits check
-    credits = get_user_credits(user_id) or 0
-    if credits <= 0:
-        await update.message.reply_text("اعتبار شما کافی نیست. از /buyplan استفاده کنید.")
-        return
-    decrement_user_credits(user_id)
-
-    msg = await update.message.reply_text("در حال پردازش...")
-
-    # Gemini
-    resp = get_cached_response(text, "Gemini")
-    if resp:
-        answer = resp
-    else:
-        data = get_gemini_response(text)
-        if not data:
-            add_credits_to_user(user_id, 1)
-            await update.message.reply_text("خطا در هوش مصنوعی. اعتبار شما بازگردانده شد.")
-            return
-        parts = data.get('candidates', [{}])[0].get('content', {}).get('parts', [])
-        answer = ''.join(p.get('text','') for p in parts)
-        store_cached_response(text, answer, "Gemini", expires_in_seconds=300)
-
-    add_message(
-        user_id=user_id,
-        text=text,
-        enhanced_text=text,
-        gemini_response=answer,
-        deepseek_response=None,
-        response_text=answer,
-        timestamp=update.message.date.isoformat(),
-        response_timestamp=datetime.datetime.utcnow().isoformat()
-    )
-    await msg.edit_text(answer)
+            reserved = storage.reserve_request(request_id, user_id, chat_id, text, asked_at)
+        except AlreadyJournaled:
+            # Another handler (or a replay) owns this request and will answer it.
+            logger.info(f"Request {request_id} from {user_id} is already being answered")
+            return True
+        if not reserved:
+            await send("اعتبار شما کافی نیست. از /buyplan استفاده کنید.")
+            return False
+
+        try:
+            # The placeholder and the final edit; broadcasts slow down while replies are busy.
+            interactive_traffic.record(2)
+            msg = await send("در حال پردازش...")
+
+            # Gemini
+            resp = response_cache.get(text)
+            prompt_tokens = output_tokens = 0
+            model = None
+            if resp:
+                answer = resp
+            else:
+                try:
+                    plan = token_budget.plan(user_id, text)
+                    async with admission.admit(user_id):
+                        # requests is blocking; run it in a thread so other updates keep flowing.
+                        data = await asyncio.to_thread(call_gemini, user_id, text, plan)
+                except BudgetExceeded as e:
+                    logger.warning(f"Refused request from {user_id}: {e}")
+                    storage.release_request(request_id)
+                    if e.scope == "user":
+                        await msg.edit_text("سقف استفاده روزانه شما پر شده است. لطفا فردا دوباره تلاش کنید. اعتبار شما کسر نشد.")
+                    else:
+                        await msg.edit_text("ظرفیت روزانه ربات پر شده است. لطفا فردا دوباره تلاش کنید. اعتبار شما کسر نشد.")
+                    return False
+                except Overloaded as e:
+                    logger.warning(f"Shed request from {user_id}: {e}")
+                    storage.release_request(request_id)
+                    await msg.edit_text("ربات در حال حاضر شلوغ است. لطفا چند لحظه دیگر دوباره تلاش کنید. اعتبار شما کسر نشد.")
+                    return False
+                if data:
+                    prompt_tokens, output_tokens = extract_usage(data)
+                    model = plan.model
+                answer = extract_answer_text(data) if data else None
+                if not answer:
+                    storage.release_request(request_id)
+                    await send("خطا در هوش مصنوعی. اعتبار شما بازگردانده شد.")
+                    return False
+                response_cache.store(text, answer)
+
+            storage.settle_request(request_id, {
+                "user_id": user_id,
+                "text": text,
+                "enhanced_text": text,
+                "gemini_response": answer,
+                "deepseek_response": None,
+                "response_text": answer,
+                "timestamp": asked_at,
+                "response_timestamp": datetime.datetime.utcnow().isoformat(),
+                "cache_hit": bool(resp),
+                "prompt_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+                "model": model,
+            })
+        except asyncio.CancelledError:
+            storage.release_request(request_id, keep=True)
+            raise
+        except Exception:
+            storage.release_request(request_id)
+            raise
+        await msg.edit_text(answer)
+        return True
+
+async def replay_unfinished_requests(application: Application):
+    """Answers the questions that the previous run charged for but never answered."""
+    for request_id, user_id, chat_id, text, asked_at, status in storage.get_unfinished_requests(lifecycle.started_at):
+        # A crash leaves the credit reserved; give it back so the replay charges it like a new question.
+        storage.release_request(request_id)
+        logger.info(f"Replaying {status} request {request_id} from {user_id}")
+        try:
+            await answer_question(request_id, user_id, chat_id, text, asked_at,
+                                  functools.partial(application.bot.send_message, chat_id))
+        except Exception as e:
+            logger.error(f"Error replaying request {request_id}: {e}")
 
 async def buy_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
     user = update.effective_user
     if not user:
         return
     user_id = f"{user.id}-0"
-    if not get_user_phone_number(user_id):
-        kb = [[KeyboardButton("اشتراک گذاری مخاطب", request_contact=True)]]
-        markup = ReplyKeyboardMarkup(kb, one_time_keyboard=True, resize_keyboard=True)
+    if not storage.get_user_phone_number(user_id):
         await update.message.reply_text(
             "لطفا شماره موبایل خود را به اشتراک بگذارید.",
-            reply_markup=markup
+            reply_markup=contact_keyboard()
         )
         return
-    plans = get_all_plans() or []
+    plans = storage.get_all_plans() or []
     if not plans:
         await update.message.reply_text("هیچ پلنی موجود نیست.")
         return
@@ -193,24 +322,144 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
         # omitted payment logic for brevity
         await query.edit_message_text("Payment flow not shown in this snippet.")
 
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or user.id not in ADMIN_USER_IDS:
+        return
+    # Everything after the command, which may start on the next line.
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    if not text:
+        await update.message.reply_text("استفاده: /broadcast <متن پیام>")
+        return
+    broadcast_id = storage.create_broadcast(text)
+    # Logged when it finishes or fails; cancelled on shutdown and resumed by worker 0 after the restart.
+    lifecycle.add_background(context.application.bot_data["broadcaster"].start(broadcast_id))
+    await update.message.reply_text(f"ارسال همگانی {broadcast_id} شروع شد.")
+
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or user.id not in ADMIN_USER_IDS:
+        return
+    broadcasts = storage.get_unfinished_broadcasts()
+    if not broadcasts:
+        await update.message.reply_text("هیچ ارسال همگانی در جریان نیست.")
+        return
+    await update.message.reply_text("\n".join(
+        f"#{broadcast_id} {status}: {sent} ارسال، {failed} ناموفق"
+        for broadcast_id, _, status, _, sent, failed in broadcasts
+    ))
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or user.id not in ADMIN_USER_IDS:
+        return
+    metrics = admission.metrics()
+    lines = [f"صف: حداکثر {metrics['queue_size']}، همزمانی: حداکثر {metrics['max_concurrency']}"]
+    for class_name in ("paid", "free"):
+        m = metrics[class_name]
+        lines.append(
+            f"{class_name}: فعال {m['active']}/{m['limit']}، در صف {m['waiting']}، "
+            f"پذیرفته {m['admitted']}، رد شده {m['shed']}، میانگین انتظار {m['avg_wait_seconds']}s"
+        )
+    _, tokens_today = storage.get_token_usage(today())
+    lines.append(f"توکن امروز: {tokens_today}" + (f" از {token_budget.global_daily}" if token_budget.global_daily else ""))
+    if update_dedup:
+        lines.append(f"به‌روزرسانی‌های تکراری حذف شده: {update_dedup.duplicates}")
+    await update.message.reply_text("\n".join(lines))
+
+async def start_background_tasks(application: Application):
+    """
+    Broadcasts, cache refreshing and replays; run in one process only (worker 0 in multi-worker mode).
+
+    With run_polling this runs in post_init, before the application is running, so the
+    tasks are plain asyncio tasks owned by the lifecycle, which stops them on shutdown.
+    """
+    cache_warmer.preload()
+    # Broadcasts checkpoint after every recipient, so cancelling these on shutdown loses nothing.
+    lifecycle.add_background(asyncio.create_task(application.bot_data["broadcaster"].supervise()))
+    lifecycle.add_background(asyncio.create_task(cache_warmer.run()))
+    lifecycle.add_background(asyncio.create_task(replay_unfinished_requests(application)))
+
+def begin_shutdown(application: Application):
+    if lifecycle.stopping:
+        return
+    mark_not_ready()
+    lifecycle.shutdown()
+    # run_polling then stops fetching updates and waits for the handlers, which the
+    # lifecycle cancels once the drain deadline passes.
+    application.stop_running()
+
+async def report_ready(application: Application, poll_interval=0.1):
+    """Marks the bot ready once run_polling has started the updater and the application."""
+    while not (application.running and application.updater.running):
+        await asyncio.sleep(poll_interval)
+    if not lifecycle.stopping:
+        mark_ready()
+
+async def on_ready(application: Application):
+    await start_background_tasks(application)
+    lifecycle.install_signal_handlers(functools.partial(begin_shutdown, application))
+    # post_init runs before polling starts, so readiness is reported from a task.
+    lifecycle.add_background(asyncio.create_task(report_ready(application)))
+
+async def on_shutdown(application: Application):
+    mark_not_ready()
+    await lifecycle.stop_background()
+    update_dedup.save()
+    storage.close()
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.error("Update error:", exc_info=context.error)
 
-def main():
+def build_application(with_updater=True):
+    from telegram import Update
+    from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+
+    global update_dedup
+    init_services()
     builder = Application.builder().token(TELEGRAM_API_TOKEN)
     if PROXY_URL:
-        builder = builder.proxy(PROXY_URL).get_updates_proxy(PROXY_URL)
+        builder = builder.proxy(PROXY_URL)
+        if with_updater:
+            builder = builder.get_updates_proxy(PROXY_URL)
+    if not with_updater:
+        # Worker processes get their updates from the dispatcher in workers.py.
+        builder = builder.updater(None)
+    else:
+        # post_init only runs with run_polling; workers.py starts the tasks in worker 0 itself.
+        builder = builder.post_init(on_ready).post_shutdown(on_shutdown)
+    # Handle updates concurrently so a slow Gemini call doesn't hold up everyone else;
+    # the admission controller decides how many actually reach Gemini. This includes
+    # updates from the same user, which are not handled in order.
+    builder = builder.concurrent_updates(True)
     application: Application = builder.build()
+    application.bot_data["broadcaster"] = Broadcaster(application.bot, storage)
+
+    if with_updater:
+        update_dedup = UpdateDeduplicator(storage)
+        application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
 
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('buyplan', buy_plan))
+    application.add_handler(CommandHandler('broadcast', broadcast_command))
+    application.add_handler(CommandHandler('broadcast_status', broadcast_status))
+    application.add_handler(CommandHandler('stats', stats_command))
     application.add_handler(MessageHandler(filters.CONTACT, handle_contact))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(CallbackQueryHandler(button_callback_handler))
     application.add_error_handler(error_handler)
+    return application
 
-    application.run_polling()
+def main():
+    # /live answers from here on; /ready once updates are being handled.
+    start_probe_server()
+    if BOT_WORKERS > 1:
+        from workers import main as run_workers
+        run_workers(BOT_WORKERS)
+        return
+    build_application().run_polling()
 
 if __name__ == '__main__':
     main()
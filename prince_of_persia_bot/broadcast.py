@@ -0,0 +1,245 @@
+import sys
+import time
+import asyncio
+import logging
+import functools
+import collections
+
+from config import TELEGRAM_GLOBAL_RATE, BROADCAST_RATE, BROADCAST_PAGE_SIZE, BROADCAST_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MAX_RETRIES = 3
+# How often each worker publishes its reply rate and reads the others'.
+REPLY_RATE_SHARE_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity` (evenly paced by default)."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Stops handing out tokens for `seconds`, e.g. after Telegram answers 429 with retry_after."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    async def acquire(self, available_rate=None):
+        """
+        Waits for a token. `available_rate` is a callable that can lower the rate below
+        `rate` while other traffic needs the capacity.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                rate = self.rate if available_rate is None else min(self.rate, available_rate())
+                if rate <= 0:
+                    self._updated = now
+                    await asyncio.sleep(1 / self.rate)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / rate)
+
+
+class InteractiveTraffic:
+    """
+    Counts replies sent to users over the last second so broadcasts can yield to them.
+
+    With several worker processes, each runs share() so that rate() also includes the
+    replies of the other workers, about a second late.
+    """
+
+    def __init__(self, window_seconds=1.0):
+        self.window_seconds = window_seconds
+        self._sent = collections.deque()
+        self._others = 0.0
+
+    def record(self, count=1):
+        now = time.monotonic()
+        self._sent.extend([now] * count)
+
+    def local_rate(self):
+        cutoff = time.monotonic() - self.window_seconds
+        while self._sent and self._sent[0] < cutoff:
+            self._sent.popleft()
+        return len(self._sent) / self.window_seconds
+
+    def rate(self):
+        return self.local_rate() + self._others
+
+    async def share(self, storage, worker, interval=REPLY_RATE_SHARE_SECONDS):
+        """Publishes this process's rate under `worker` and picks up the others', every `interval` seconds."""
+        while True:
+            try:
+                storage.save_reply_rate(worker, self.local_rate())
+                # Rates not refreshed for a few intervals belong to workers that stopped.
+                self._others = storage.get_reply_rate(time.time() - 3 * interval, exclude=worker)
+            except Exception as e:
+                logger.error(f"Error sharing reply rate: {e}")
+            await asyncio.sleep(interval)
+
+
+interactive_traffic = InteractiveTraffic()
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    # python-telegram-bot reports retry_after as a timedelta in newer releases.
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class Broadcaster:
+    """Sends broadcasts from the Broadcast table, checkpointing after every recipient."""
+
+    def __init__(self, bot, storage, rate=BROADCAST_RATE, page_size=BROADCAST_PAGE_SIZE, traffic=interactive_traffic):
+        self.bot = bot
+        self.storage = storage
+        self.page_size = page_size
+        self.traffic = traffic
+        self.bucket = TokenBucket(rate)
+        self._running = {}
+
+    def _available_rate(self):
+        return TELEGRAM_GLOBAL_RATE - self.traffic.rate()
+
+    async def _send(self, chat_id, text):
+        """Returns True if delivered, False if the user can't be reached."""
+        from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
+        attempt = 0
+        while attempt < BROADCAST_MAX_RETRIES:
+            await self.bucket.acquire(self._available_rate)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                # Telegram's flood control applies to the whole bot, so every send waits. The
+                # message itself was fine, so this doesn't count as a failed attempt.
+                seconds = _retry_after_seconds(e)
+                logger.warning(f"Broadcast throttled by Telegram, pausing {seconds}s")
+                self.bucket.pause(seconds)
+            except (Forbidden, BadRequest) as e:
+                # Blocked the bot, deleted account or invalid chat: retrying won't help.
+                logger.info(f"Broadcast skipped chat {chat_id}: {e}")
+                return False
+            except NetworkError as e:
+                attempt += 1
+                logger.warning(f"Broadcast network error for chat {chat_id} (attempt {attempt}): {e}")
+                await asyncio.sleep(2 ** (attempt - 1))
+        return False
+
+    async def run(self, broadcast_id, resume=False):
+        """
+        Sends one broadcast to the end, continuing from its last checkpoint.
+
+        Pending broadcasts are claimed first so only one worker sends them. A broadcast that is
+        already 'running' is only taken over with `resume`, i.e. after its previous owner crashed.
+        """
+        row = self.storage.get_broadcast(broadcast_id)
+        if not row:
+            return
+        _, text, status, last_user_id, sent_count, failed_count = row
+        if status == "pending":
+            if not self.storage.claim_broadcast(broadcast_id):
+                return
+        elif status != "running" or not resume:
+            return
+        logger.info(f"Broadcast {broadcast_id} running from user {last_user_id!r}")
+        while True:
+            page = self.storage.get_user_chats_after(last_user_id, self.page_size)
+            if not page:
+                break
+            for user_id, platform_user_id in page:
+                if await self._send(int(platform_user_id), text):
+                    sent_count += 1
+                else:
+                    failed_count += 1
+                last_user_id = user_id
+                self.storage.save_broadcast_progress(broadcast_id, "running", last_user_id, sent_count, failed_count)
+        self.storage.save_broadcast_progress(broadcast_id, "done", last_user_id, sent_count, failed_count)
+        logger.info(f"Broadcast {broadcast_id} done: {sent_count} sent, {failed_count} failed")
+
+    def start(self, broadcast_id, resume=False):
+        """Runs the broadcast in the background unless this process is already running it."""
+        task = self._running.get(broadcast_id)
+        if task and not task.done():
+            return task
+        task = asyncio.create_task(self.run(broadcast_id, resume), name=f"broadcast-{broadcast_id}")
+        self._running[broadcast_id] = task
+        task.add_done_callback(functools.partial(self._finished, broadcast_id))
+        return task
+
+    def _finished(self, broadcast_id, task):
+        self._running.pop(broadcast_id, None)
+        if task.cancelled():
+            # Left 'running' at its last checkpoint; supervise() resumes it after the restart.
+            logger.info(f"Broadcast {broadcast_id} interrupted")
+        elif task.exception():
+            logger.error(f"Broadcast {broadcast_id} failed", exc_info=task.exception())
+
+    def cancel_all(self):
+        for task in list(self._running.values()):
+            task.cancel()
+
+    async def supervise(self, poll_seconds=BROADCAST_POLL_SECONDS):
+        """
+        Resumes broadcasts interrupted by a crash, then keeps picking up ones queued from the
+        command line. Run it in one process only.
+        """
+        resume = True
+        try:
+            while True:
+                try:
+                    for broadcast_id, *_ in self.storage.get_unfinished_broadcasts():
+                        self.start(broadcast_id, resume)
+                    resume = False
+                except Exception as e:
+                    logger.error(f"Error checking for broadcasts: {e}")
+                await asyncio.sleep(poll_seconds)
+        finally:
+            # Broadcasts checkpoint after every recipient, so stopping them loses nothing.
+            self.cancel_all()
+
+
+def plan_promo_text(plan):
+    plan_id, name, price, credits, description = plan
+    text = f"پلن جدید: {name}\n{credits} اعتبار به قیمت {price}"
+    if description:
+        text += f"\n{description}"
+    return text + "\nبرای خرید از /buyplan استفاده کنید."
+
+
+if __name__ == '__main__':
+    # Queues a broadcast; the running bot picks it up within BROADCAST_POLL_SECONDS.
+    #   python broadcast.py "متن پیام"
+    #   python broadcast.py --plan 3
+    from storage import get_storage
+
+    if len(sys.argv) < 2:
+        print("Usage: python broadcast.py <text> | --plan <plan_id>")
+        sys.exit(1)
+    storage = get_storage()
+    if sys.argv[1] == "--plan":
+        plan = storage.get_plan_by_id(int(sys.argv[2]))
+        if not plan:
+            print(f"Plan {sys.argv[2]} not found.")
+            sys.exit(1)
+        text = plan_promo_text(plan)
+    else:
+        text = " ".join(sys.argv[1:])
+    broadcast_id = storage.create_broadcast(text)
+    print(f"Broadcast {broadcast_id} queued.")
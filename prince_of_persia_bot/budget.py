@@ -0,0 +1,94 @@
+import datetime
+import collections
+
+from config import (
+    USER_DAILY_TOKEN_BUDGET,
+    GLOBAL_DAILY_TOKEN_BUDGET,
+    TOKEN_BUDGET_LOW_FRACTION,
+    GEMINI_MODEL,
+    GEMINI_CHEAP_MODEL,
+    GEMINI_MAX_OUTPUT_TOKENS,
+    MODEL_PRICES,
+)
+
+# Prompts are sized before the call from their length; Persian text averages about this many characters per token.
+CHARS_PER_TOKEN = 3
+# A request with less room than this left for the answer isn't worth sending.
+MIN_OUTPUT_TOKENS = 64
+
+# How to call Gemini for one request; `reduced` is set when a budget is running low.
+RequestPlan = collections.namedtuple("RequestPlan", "model max_output_tokens reduced")
+
+
+class BudgetExceeded(Exception):
+    """Raised when a request doesn't fit in what is left of a token budget. `scope` is "user" or "global"."""
+
+    def __init__(self, scope):
+        super().__init__(f"{scope} token budget exhausted")
+        self.scope = scope
+
+
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def estimate_prompt_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def token_cost(model, prompt_tokens, output_tokens):
+    """USD cost of the tokens, or 0.0 for a model missing from MODEL_PRICES."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class TokenBudget:
+    """
+    Daily token budgets per user and for the whole bot, checked before every Gemini call.
+
+    Usage is kept in storage, so every worker sees the same totals. A request that doesn't
+    fit in what is left is refused with BudgetExceeded. Once less than `low_fraction` of
+    a budget is left, requests go to the cheaper model, and answers are always capped at
+    the tokens left. Calls already in flight can overshoot a budget by at most their caps.
+    """
+
+    def __init__(self, storage, user_daily=USER_DAILY_TOKEN_BUDGET, global_daily=GLOBAL_DAILY_TOKEN_BUDGET,
+                 low_fraction=TOKEN_BUDGET_LOW_FRACTION, model=GEMINI_MODEL, cheap_model=GEMINI_CHEAP_MODEL,
+                 max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS):
+        self.storage = storage
+        self.user_daily = user_daily
+        self.global_daily = global_daily
+        self.low_fraction = low_fraction
+        self.model = model
+        self.cheap_model = cheap_model
+        self.max_output_tokens = max_output_tokens
+
+    def remaining(self, user_id=None):
+        """Returns (user's tokens left, all users' tokens left) today, None where there is no limit."""
+        user_used, total_used = self.storage.get_token_usage(today(), user_id)
+        user_left = self.user_daily - user_used if self.user_daily and user_id is not None else None
+        total_left = self.global_daily - total_used if self.global_daily else None
+        return user_left, total_left
+
+    def plan(self, user_id, prompt):
+        """Picks the model and output cap for a request. `user_id` None checks the global budget only."""
+        user_left, total_left = self.remaining(user_id)
+        prompt_tokens = estimate_prompt_tokens(prompt)
+        if user_left is not None and user_left < prompt_tokens + MIN_OUTPUT_TOKENS:
+            raise BudgetExceeded("user")
+        if total_left is not None and total_left < prompt_tokens + MIN_OUTPUT_TOKENS:
+            raise BudgetExceeded("global")
+
+        limits = [(left, budget) for left, budget in ((user_left, self.user_daily), (total_left, self.global_daily))
+                  if left is not None]
+        reduced = any(left < budget * self.low_fraction for left, budget in limits)
+        model = self.cheap_model if reduced and self.cheap_model else self.model
+        max_output_tokens = self.max_output_tokens
+        if limits:
+            room = min(left for left, _ in limits) - prompt_tokens
+            max_output_tokens = min(max_output_tokens, room) if max_output_tokens else room
+        return RequestPlan(model, max_output_tokens, reduced)
+
+    def record(self, user_id, model, prompt_tokens, output_tokens):
+        """Records a Gemini call, whether or not its answer was usable. `user_id` None for calls made by the bot itself."""
+        self.storage.add_token_usage(today(), user_id, model, prompt_tokens, output_tokens)
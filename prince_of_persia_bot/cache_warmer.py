@@ -0,0 +1,199 @@
+import re
+import math
+import time
+import asyncio
+import logging
+import datetime
+import collections
+
+from config import (
+    CACHE_BASE_TTL_SECONDS,
+    CACHE_MAX_TTL_SECONDS,
+    CACHE_WARM_WINDOW_HOURS,
+    CACHE_WARM_TOP_N,
+    CACHE_WARM_MIN_ASKS,
+    CACHE_REFRESH_AHEAD_FRACTION,
+    CACHE_REFRESH_INTERVAL_SECONDS,
+    CACHE_MINE_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+# Arabic letters that Persian keyboards and users mix up with their Persian forms.
+_PERSIAN_LETTERS = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک", "‌": " "})
+
+
+def normalize_question(text):
+    """Cache key for a question: case, spacing, trailing punctuation and Arabic/Persian letter variants don't matter."""
+    text = _WHITESPACE.sub(" ", text.translate(_PERSIAN_LETTERS)).strip().casefold()
+    return text.rstrip("?؟!.。 ")
+
+
+def adaptive_ttl(asks_per_hour):
+    """Base TTL for rare questions, growing with the log of the ask rate (asks per hour), up to the maximum."""
+    ttl = CACHE_BASE_TTL_SECONDS * (1 + math.log2(1 + asks_per_hour))
+    return int(min(CACHE_MAX_TTL_SECONDS, ttl))
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: a process-local dict in front of the shared Cache table.
+
+    Keys are normalized questions. Every lookup counts towards the question's ask rate,
+    which sets the TTL of the answer when it is stored.
+    """
+
+    def __init__(self, storage, service="Gemini"):
+        self.storage = storage
+        self.service = service
+        self._local = {}  # key -> (response, expires_at epoch seconds)
+        self._asks = collections.Counter()  # key -> asks in the mining window (plus since the last mining)
+        self._window_started = time.time()
+
+    def _asks_per_hour(self, key):
+        hours = max(1.0, (time.time() - self._window_started) / 3600)
+        return self._asks[key] / hours
+
+    def ttl_for(self, question):
+        return adaptive_ttl(self._asks_per_hour(normalize_question(question)))
+
+    def get(self, question):
+        key = normalize_question(question)
+        self._asks[key] += 1
+        entry = self._local.get(key)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        entry = self.storage.get_cache_entry(key, self.service)
+        if not entry:
+            self._local.pop(key, None)
+            return None
+        response, expires_at = entry
+        self._local[key] = (response, expires_at.timestamp())
+        return response
+
+    def store(self, question, response):
+        key = normalize_question(question)
+        ttl = adaptive_ttl(self._asks_per_hour(key))
+        self.storage.store_cached_response(key, response, self.service, expires_in_seconds=ttl)
+        self._local[key] = (response, time.time() + ttl)
+
+    def expires_at(self, key):
+        entry = self._local.get(key)
+        return entry[1] if entry else None
+
+    def preload(self, keys):
+        """Copies unexpired answers for `keys` from the shared table into the local tier."""
+        loaded = 0
+        for key in keys:
+            entry = self.storage.get_cache_entry(key, self.service)
+            if entry:
+                self._local[key] = (entry[0], entry[1].timestamp())
+                loaded += 1
+        return loaded
+
+    def reset_asks(self, asks, window_hours):
+        """Replaces the ask counts with freshly mined ones covering the last `window_hours`."""
+        self._asks = collections.Counter(asks)
+        self._window_started = time.time() - window_hours * 3600
+
+    def purge_local(self):
+        now = time.time()
+        for key in [key for key, entry in self._local.items() if entry[1] <= now]:
+            del self._local[key]
+
+
+class CacheWarmer:
+    """
+    Keeps answers to popular questions in the cache.
+
+    Popular questions are mined from Message history and preloaded into the local tier.
+    Hot answers are fetched again shortly before they expire (refresh-ahead), so users
+    asking them never wait for Gemini. Refreshing backs off whenever the admission queue
+    has users waiting, and only one process should do it; every other process runs
+    run(refresh=False) to keep its ask rates current and its local tier bounded.
+    """
+
+    def __init__(self, cache, fetch_answer, admission=None,
+                 top_n=CACHE_WARM_TOP_N, min_asks=CACHE_WARM_MIN_ASKS, window_hours=CACHE_WARM_WINDOW_HOURS):
+        self.cache = cache
+        self.fetch_answer = fetch_answer  # blocking callable: question text -> answer text or None
+        self.admission = admission
+        self.top_n = top_n
+        self.min_asks = min_asks
+        self.window_hours = window_hours
+        self.hot = {}  # normalized key -> most common original wording
+
+    def mine(self):
+        """Finds the most asked questions in the window and updates the cache's ask rates."""
+        since = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=self.window_hours)).isoformat()
+        asks = collections.Counter()
+        wording = {}
+        # Over-fetch: several raw wordings can collapse into one normalized question.
+        for text, count in self.cache.storage.get_popular_questions(since, self.top_n * 4):
+            key = normalize_question(text)
+            asks[key] += count
+            wording.setdefault(key, text)
+        self.cache.reset_asks(asks, self.window_hours)
+        self.hot = {key: wording[key] for key, count in asks.most_common(self.top_n) if count >= self.min_asks}
+        return self.hot
+
+    def preload(self):
+        self.mine()
+        loaded = self.cache.preload(self.hot)
+        logger.info(f"Cache warm-up: {len(self.hot)} popular questions, {loaded} answers preloaded")
+
+    def _upstream_busy(self):
+        if not self.admission:
+            return False
+        metrics = self.admission.metrics()
+        return any(metrics[class_name]["waiting"] for class_name in ("paid", "free"))
+
+    def due_for_refresh(self):
+        now = time.time()
+        due = []
+        for key, text in self.hot.items():
+            expires_at = self.cache.expires_at(key)
+            if expires_at is None and self.cache.preload([key]):
+                # Another worker already stored it in the shared table.
+                expires_at = self.cache.expires_at(key)
+            ttl = self.cache.ttl_for(key)
+            if expires_at is None or expires_at - now < ttl * CACHE_REFRESH_AHEAD_FRACTION:
+                due.append(text)
+        return due
+
+    async def refresh_due(self):
+        refreshed = 0
+        for text in self.due_for_refresh():
+            if self._upstream_busy():
+                break
+            answer = await asyncio.to_thread(self.fetch_answer, text)
+            if answer:
+                self.cache.store(text, answer)
+                refreshed += 1
+        self.cache.purge_local()
+        return refreshed
+
+    async def run(self, refresh=True, refresh_interval=CACHE_REFRESH_INTERVAL_SECONDS,
+                  mine_interval=CACHE_MINE_INTERVAL_SECONDS):
+        """
+        Re-mines the ask rates every `mine_interval` and purges expired local answers every
+        `refresh_interval`. With `refresh`, also fetches due answers and cleans the shared table.
+        """
+        last_mined = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - last_mined >= mine_interval:
+                    self.mine()
+                    if refresh:
+                        self.cache.storage.delete_expired_cache()
+                    last_mined = time.monotonic()
+                if refresh:
+                    refreshed = await self.refresh_due()
+                    if refreshed:
+                        logger.info(f"Cache warm-up: refreshed {refreshed} answers")
+                else:
+                    self.cache.purge_local()
+            except Exception as e:
+                logger.error(f"Error warming cache: {e}")
+            await asyncio.sleep(refresh_interval)
@@ -0,0 +1,115 @@
+"""
+Bot configuration, read from the environment once.
+
+The .env file is loaded when this module is first imported; every other module takes
+its settings from here instead of calling load_dotenv/os.getenv itself.
+"""
+import os
+
+try:
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv is optional when the environment is set another way
+    load_dotenv = None
+
+if load_dotenv:
+    load_dotenv()
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+# Telegram
+TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
+BOT_CALLBACK_BASE_URL = os.getenv("BOT_CALLBACK_BASE_URL", "https://example.com")
+PROXY_URL = os.getenv("PROXY_URL")
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Upstream services
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-04-17")
+# Used instead of GEMINI_MODEL once a token budget runs low; leave empty to keep GEMINI_MODEL.
+GEMINI_CHEAP_MODEL = os.getenv("GEMINI_CHEAP_MODEL", "gemini-2.0-flash-lite")
+# Upper bound for every answer (thinking tokens included); 0 leaves it to the model.
+GEMINI_MAX_OUTPUT_TOKENS = _int("GEMINI_MAX_OUTPUT_TOKENS", "4096")
+# A call that hangs would hold its admission slot and keep the process from exiting after the drain.
+GEMINI_TIMEOUT_SECONDS = _float("GEMINI_TIMEOUT_SECONDS", "60")
+ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID", "YOUR_ZARINPAL_MERCHANT_ID") # Placeholder
+
+# Storage
+# "sqlite" stores everything in the bot database file, "memory" is for tests and benchmarks.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SQLITE_BUSY_TIMEOUT_MS = _int("SQLITE_BUSY_TIMEOUT_MS", "5000")
+
+# Workers
+BOT_WORKERS = _int("BOT_WORKERS", "1")
+WORKER_QUEUE_SIZE = _int("WORKER_QUEUE_SIZE", "1000")
+
+# Startup and readiness: the file is created once the bot is ready and removed when it stops.
+BOT_READY_FILE = os.getenv("BOT_READY_FILE")
+# Port for the /ready and /live HTTP probes, disabled when unset.
+HEALTH_PORT = _int("HEALTH_PORT", "0")
+# On SIGTERM, handlers still running after this many seconds are cancelled: their credits
+# are refunded and their questions answered after the next boot. Keep it below the process
+# manager's stop timeout (e.g. Docker's 10 seconds, Kubernetes' 30).
+SHUTDOWN_DRAIN_SECONDS = _float("SHUTDOWN_DRAIN_SECONDS", "8")
+
+# Token budgets
+# Gemini tokens (prompt + output) allowed per UTC day, per user and for the whole bot; 0 means no limit.
+USER_DAILY_TOKEN_BUDGET = _int("USER_DAILY_TOKEN_BUDGET", "100000")
+GLOBAL_DAILY_TOKEN_BUDGET = _int("GLOBAL_DAILY_TOKEN_BUDGET", "5000000")
+# Once less than this fraction of a budget is left, requests go to GEMINI_CHEAP_MODEL
+# and cache refreshes stop.
+TOKEN_BUDGET_LOW_FRACTION = _float("TOKEN_BUDGET_LOW_FRACTION", "0.2")
+# USD per million (input, output) tokens, for cost reports. Check against current Gemini pricing.
+MODEL_PRICES = {
+    "gemini-2.5-flash-preview-04-17": (0.15, 0.60),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+
+# Update de-duplication
+# Recent update ids remembered for spotting redeliveries, and how often the high-water mark is saved.
+UPDATE_DEDUP_WINDOW = _int("UPDATE_DEDUP_WINDOW", "10000")
+UPDATE_DEDUP_SAVE_SECONDS = _float("UPDATE_DEDUP_SAVE_SECONDS", "1")
+
+# Broadcasts
+# Telegram allows roughly 30 messages per second per bot. Broadcasts take at most BROADCAST_RATE
+# of that and leave the rest for replies to users, and they back off further when replies are busy.
+TELEGRAM_GLOBAL_RATE = _float("TELEGRAM_GLOBAL_RATE", "30")
+BROADCAST_RATE = _float("BROADCAST_RATE", "20")
+BROADCAST_PAGE_SIZE = _int("BROADCAST_PAGE_SIZE", "500")
+BROADCAST_POLL_SECONDS = _int("BROADCAST_POLL_SECONDS", "60")
+
+# Admission control
+# Upstream calls allowed at once, in total and per priority class.
+ADMISSION_MAX_CONCURRENCY = _int("ADMISSION_MAX_CONCURRENCY", "8")
+ADMISSION_PAID_CONCURRENCY = _int("ADMISSION_PAID_CONCURRENCY", "8")
+ADMISSION_FREE_CONCURRENCY = _int("ADMISSION_FREE_CONCURRENCY", "3")
+# Requests allowed to wait for a slot, and how long they may wait before being turned away.
+ADMISSION_QUEUE_SIZE = _int("ADMISSION_QUEUE_SIZE", "50")
+ADMISSION_MAX_WAIT_SECONDS = _float("ADMISSION_MAX_WAIT_SECONDS", "15")
+# How long a user's priority class is remembered before Payment is checked again.
+ADMISSION_PRIORITY_TTL_SECONDS = _int("ADMISSION_PRIORITY_TTL_SECONDS", "300")
+
+# Response cache
+# TTLs grow with how often a question is asked, between these bounds (seconds).
+CACHE_BASE_TTL_SECONDS = _int("CACHE_BASE_TTL_SECONDS", "300")
+CACHE_MAX_TTL_SECONDS = _int("CACHE_MAX_TTL_SECONDS", "21600")
+# Popular questions are mined from this much Message history.
+CACHE_WARM_WINDOW_HOURS = _int("CACHE_WARM_WINDOW_HOURS", "24")
+CACHE_WARM_TOP_N = _int("CACHE_WARM_TOP_N", "50")
+CACHE_WARM_MIN_ASKS = _int("CACHE_WARM_MIN_ASKS", "3")
+# A hot answer is refreshed once less than this fraction of its TTL is left.
+CACHE_REFRESH_AHEAD_FRACTION = _float("CACHE_REFRESH_AHEAD_FRACTION", "0.2")
+CACHE_REFRESH_INTERVAL_SECONDS = _int("CACHE_REFRESH_INTERVAL_SECONDS", "60")
+# How often the popular questions are mined again.
+CACHE_MINE_INTERVAL_SECONDS = _int("CACHE_MINE_INTERVAL_SECONDS", "900")
+
+# Analytics
+# Rollups live in their own file so reports never touch the bot database.
+ANALYTICS_DATABASE_FILE = os.getenv("ANALYTICS_DATABASE_FILE", "analytics.db")
+ANALYTICS_BATCH_SIZE = _int("ANALYTICS_BATCH_SIZE", "5000")
@@ -0,0 +1,78 @@
+import time
+import collections
+
+from config import UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_SAVE_SECONDS
+
+# Telegram picks update ids at random again after a week without updates.
+UPDATE_ID_RESET_SECONDS = 6 * 24 * 3600
+
+
+class UpdateDeduplicator:
+    """
+    Drops updates that were already handled, e.g. redelivered after a crash or a webhook retry.
+
+    Recent update ids and callback query ids are kept in bounded ring buffers with a set
+    alongside for O(1) lookups. Update ids only grow, so everything at or below the floor
+    counts as seen: the floor is the persisted high-water mark of the previous run, raised
+    to every id that falls out of the window. Checking never touches storage; the
+    high-water mark is saved at most every `save_seconds` and on save().
+    """
+
+    def __init__(self, storage, name="telegram", window=UPDATE_DEDUP_WINDOW, save_seconds=UPDATE_DEDUP_SAVE_SECONDS):
+        self.storage = storage
+        self.name = name
+        self.save_seconds = save_seconds
+        self._update_ids = collections.deque(maxlen=window)
+        self._update_id_set = set()
+        self._callback_ids = collections.deque(maxlen=window)
+        self._callback_id_set = set()
+        self.duplicates = 0
+        mark = storage.get_update_watermark(name)
+        if mark and time.time() - mark[1] < UPDATE_ID_RESET_SECONDS:
+            self.floor = self.high_water_mark = mark[0]
+        else:
+            self.floor = self.high_water_mark = 0
+        self._last_seen = time.time()
+        self._saved_mark = self.high_water_mark
+        self._saved_at = time.monotonic()
+
+    def _remember(self, ring, seen, key):
+        if len(ring) == ring.maxlen:
+            evicted = ring[0]
+            seen.discard(evicted)
+            if ring is self._update_ids:
+                self.floor = max(self.floor, evicted)
+        ring.append(key)
+        seen.add(key)
+
+    def is_duplicate(self, update_id, callback_query_id=None):
+        """Records the update and returns True if it (or its callback query) was seen before."""
+        now = time.time()
+        if now - self._last_seen >= UPDATE_ID_RESET_SECONDS:
+            self._reset()
+        self._last_seen = now
+        if (update_id <= self.floor or update_id in self._update_id_set
+                or (callback_query_id is not None and callback_query_id in self._callback_id_set)):
+            self.duplicates += 1
+            return True
+        self._remember(self._update_ids, self._update_id_set, update_id)
+        if callback_query_id is not None:
+            self._remember(self._callback_ids, self._callback_id_set, callback_query_id)
+        self.high_water_mark = max(self.high_water_mark, update_id)
+        if time.monotonic() - self._saved_at >= self.save_seconds:
+            self.save()
+        return False
+
+    def _reset(self):
+        self._update_ids.clear()
+        self._update_id_set.clear()
+        self._callback_ids.clear()
+        self._callback_id_set.clear()
+        self.floor = self.high_water_mark = 0
+
+    def save(self):
+        """Persists the high-water mark if it moved. Called on shutdown too."""
+        self._saved_at = time.monotonic()
+        if self.high_water_mark != self._saved_mark:
+            self.storage.save_update_watermark(self.name, self.high_water_mark)
+            self._saved_mark = self.high_water_mark
@@ -1,13 +1,10 @@
-import os
-import requests
-from dotenv import load_dotenv
+from config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_TIMEOUT_SECONDS
+from http_client import get_session
 
-load_dotenv()
+GEMINI_API_HOST = "https://generativelanguage.googleapis.com/"
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent" # Example URL, verify with Gemini API docs
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-04-17:generateContent" # Example URL, verify with Gemini API docs
-
-def get_gemini_response(prompt):
+def get_gemini_response(prompt, model=GEMINI_MODEL, max_output_tokens=None):
     """Sends a prompt to the Gemini API and returns the response."""
     if not GEMINI_API_KEY:
         print("کلید API جیمینای یافت نشد.") # Gemini API key not found.
@@ -32,15 +29,30 @@ def get_gemini_response(prompt):
             }
         ]
     }
+    if max_output_tokens:
+        data["generationConfig"] = {"maxOutputTokens": max_output_tokens}
+
+    import requests
 
     try:
-        response = requests.post(GEMINI_API_URL, headers=headers, params=params, json=data)
+        response = get_session().post(GEMINI_API_URL.format(model=model), headers=headers, params=params, json=data,
+                                       timeout=GEMINI_TIMEOUT_SECONDS)
         response.raise_for_status() # Raise an exception for bad status codes
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"خطا در فراخوانی API جیمینای: {e}") # Error calling Gemini API: {e}
         return None
 
+def extract_answer_text(response_data):
+    """Joins the text parts of the first candidate in a Gemini response."""
+    parts = response_data.get('candidates', [{}])[0].get('content', {}).get('parts', [])
+    return ''.join(p.get('text', '') for p in parts)
+
+def extract_usage(response_data):
+    """Returns (prompt tokens, output tokens) from a response's usageMetadata. Thinking tokens are billed as output."""
+    usage = response_data.get('usageMetadata', {})
+    return usage.get('promptTokenCount', 0), usage.get('candidatesTokenCount', 0) + usage.get('thoughtsTokenCount', 0)
+
 if __name__ == '__main__':
     # Example usage
     test_prompt = "What is the capital of France?"
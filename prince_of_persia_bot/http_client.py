@@ -0,0 +1,33 @@
+"""
+Shared HTTP session for the upstream APIs.
+
+requests is imported on first use rather than at startup, and a single session is
+reused so TLS connections to Gemini and ZarinPal stay open between calls.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                _session = requests.Session()
+    return _session
+
+
+def warm_up(*urls, timeout=5):
+    """Opens pooled connections to `urls` ahead of the first real request. Failures are ignored."""
+    session = get_session()
+    for url in urls:
+        try:
+            session.head(url, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"HTTP warm-up for {url} failed: {e}")
@@ -0,0 +1,81 @@
+import time
+import signal
+import asyncio
+import logging
+import contextlib
+
+from config import SHUTDOWN_DRAIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """
+    Tracks in-flight handlers and background tasks so the bot can stop without losing work.
+
+    shutdown() cancels the background tasks right away and gives the tracked handlers
+    `drain_seconds` to finish; whatever is still running then is cancelled, and so is any
+    tracked handler that starts later. Handlers clean up after themselves on cancellation
+    (see answer_question in bot.py), so this class never touches storage.
+    """
+
+    def __init__(self, drain_seconds=SHUTDOWN_DRAIN_SECONDS):
+        self.drain_seconds = drain_seconds
+        # Work journaled before this moment belongs to an earlier run.
+        self.started_at = time.time()
+        self.stopping = False
+        self.deadline_passed = False
+        self._in_flight = set()
+        self._background = set()
+
+    def add_background(self, task):
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    @contextlib.contextmanager
+    def track(self):
+        """Marks the body of the `with` as in-flight work of the current task."""
+        task = asyncio.current_task()
+        if self.deadline_passed:
+            # Too late to start anything; the next await raises CancelledError.
+            task.cancel()
+        self._in_flight.add(task)
+        try:
+            yield
+        finally:
+            self._in_flight.discard(task)
+
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def shutdown(self):
+        """Starts the drain. Call it from the event loop; safe to call more than once."""
+        if self.stopping:
+            return
+        self.stopping = True
+        for task in list(self._background):
+            task.cancel()
+        logger.info(f"Shutting down: draining {self.in_flight()} in-flight requests for up to {self.drain_seconds}s")
+        asyncio.get_running_loop().call_later(self.drain_seconds, self._cancel_in_flight)
+
+    async def stop_background(self):
+        """Cancels the background tasks and waits for them to finish. Call it before closing storage."""
+        tasks = list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _cancel_in_flight(self):
+        self.deadline_passed = True
+        if self._in_flight:
+            logger.warning(f"Drain deadline passed, cancelling {len(self._in_flight)} requests")
+        for task in self._in_flight:
+            task.cancel()
+
+    def install_signal_handlers(self, on_signal):
+        """Calls `on_signal()` on SIGTERM and SIGINT instead of stopping the loop abruptly."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with contextlib.suppress(NotImplementedError):  # not available on Windows event loops
+                loop.add_signal_handler(sig, on_signal)
@@ -0,0 +1,56 @@
+"""
+Readiness signal for process managers and load balancers.
+
+The bot is "ready" once it is receiving and handling updates. This is reported in two
+ways, both optional: BOT_READY_FILE exists only while the bot is ready, and with
+HEALTH_PORT set, GET /ready answers 200 (or 503 while starting or stopping) and
+GET /live answers 200 as long as the process is up.
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import BOT_READY_FILE, HEALTH_PORT
+
+_ready = threading.Event()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def mark_ready():
+    _ready.set()
+    if BOT_READY_FILE:
+        with open(BOT_READY_FILE, "w") as f:
+            f.write(str(os.getpid()))
+
+
+def mark_not_ready():
+    _ready.clear()
+    if BOT_READY_FILE and os.path.exists(BOT_READY_FILE):
+        os.remove(BOT_READY_FILE)
+
+
+class _ProbeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/live":
+            status = 200
+        elif self.path == "/ready":
+            status = 200 if is_ready() else 503
+        else:
+            status = 404
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # probes hit this every few seconds; keep them out of the bot log
+
+
+def start_probe_server(port=HEALTH_PORT):
+    """Serves /live and /ready from a daemon thread. Does nothing when `port` is 0."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _ProbeHandler)
+    threading.Thread(target=server.serve_forever, name="readiness-probe", daemon=True).start()
+    return server
@@ -0,0 +1,239 @@
+import time
+import sqlite3
+import datetime
+import threading
+
+from config import SQLITE_BUSY_TIMEOUT_MS
+from database import DATABASE_FILE, ensure_schema
+
+
+class SharedState:
+    """
+    Operations that must stay correct when several bot workers run at the same time.
+
+    Every method is atomic with respect to the other workers using the same backend,
+    so check-then-act sequences (credit checks, rate limits, payment completion) never race.
+    """
+
+    def add_user(self, user_id, platform_user_id, origin, username=None, phone_number=None, initial_credits=20):
+        raise NotImplementedError
+
+    def get_user_credits(self, user_id):
+        raise NotImplementedError
+
+    def reserve_credit(self, user_id, amount=1):
+        """Takes `amount` credits from the user if they have enough. Returns True on success."""
+        raise NotImplementedError
+
+    def refund_credit(self, user_id, amount=1):
+        raise NotImplementedError
+
+    def check_rate_limit(self, user_id, interval_seconds):
+        """Returns True and records the hit if the user's previous hit is at least `interval_seconds` old."""
+        raise NotImplementedError
+
+    def clear_rate_limit(self, user_id):
+        """Forgets the user's last hit, e.g. when the request it let through was refused."""
+        raise NotImplementedError
+
+    def get_cached_response(self, question, service):
+        raise NotImplementedError
+
+    def store_cached_response(self, question, response, service, expires_in_seconds=300):
+        raise NotImplementedError
+
+    def complete_payment(self, payment_id, credits):
+        """
+        Marks the payment as completed and credits its user exactly once.
+
+        Returns True only for the call that actually completed the payment, so a callback
+        delivered to two workers cannot credit the user twice.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InMemorySharedState(SharedState):
+    """Keeps everything in process memory. Only correct when a single worker is running."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._rate_limits = {}
+        self._cache = {}
+        self._payments = {}
+
+    def add_user(self, user_id, platform_user_id, origin, username=None, phone_number=None, initial_credits=20):
+        with self._lock:
+            self._users.setdefault(user_id, {
+                "platform_user_id": platform_user_id,
+                "origin": origin,
+                "username": username,
+                "phone_number": phone_number,
+                "credits": initial_credits,
+                "created_at": datetime.datetime.now().isoformat(),
+            })
+
+    def get_user_credits(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return user["credits"] if user else None
+
+    def reserve_credit(self, user_id, amount=1):
+        with self._lock:
+            user = self._users.get(user_id)
+            if not user or user["credits"] < amount:
+                return False
+            user["credits"] -= amount
+            return True
+
+    def refund_credit(self, user_id, amount=1):
+        with self._lock:
+            if user_id in self._users:
+                self._users[user_id]["credits"] += amount
+
+    def check_rate_limit(self, user_id, interval_seconds):
+        now = time.time()
+        with self._lock:
+            last = self._rate_limits.get(user_id)
+            if last is not None and now - last < interval_seconds:
+                return False
+            self._rate_limits[user_id] = now
+            return True
+
+    def clear_rate_limit(self, user_id):
+        with self._lock:
+            self._rate_limits.pop(user_id, None)
+
+    def get_cached_response(self, question, service):
+        with self._lock:
+            entry = self._cache.get((question, service))
+            if entry and entry[1] > time.time():
+                return entry[0]
+            return None
+
+    def store_cached_response(self, question, response, service, expires_in_seconds=300):
+        with self._lock:
+            self._cache[(question, service)] = (response, time.time() + expires_in_seconds)
+
+    def complete_payment(self, payment_id, credits):
+        with self._lock:
+            # Payments are created by MemoryStorage.add_payment.
+            payment = self._payments.get(payment_id)
+            if not payment or payment["payment_status"] == "completed":
+                return False
+            payment["payment_status"] = "completed"
+            user = self._users.get(payment["user_id"])
+            if user:
+                user["credits"] += credits
+            return True
+
+
+class SQLiteSharedState(SharedState):
+    """
+    Shares state through the bot database file in WAL mode.
+
+    WAL lets readers in one worker proceed while another worker writes, and every
+    read-modify-write runs as a single statement or inside BEGIN IMMEDIATE so the
+    write lock is taken up front instead of failing halfway through.
+    """
+
+    def __init__(self, database_file=None):
+        self.database_file = database_file or DATABASE_FILE
+        self._local = threading.local()
+        # Opening the first connection also creates the file, switches it to WAL and
+        # brings the schema up to date, once per process at boot.
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        ensure_schema(conn)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads, so keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.database_file, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_user(self, user_id, platform_user_id, origin, username=None, phone_number=None, initial_credits=20):
+        created_at = datetime.datetime.now().isoformat()
+        self._connection().execute('''
+            INSERT OR IGNORE INTO User (user_id, platform_user_id, origin, username, phone_number, credits, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, platform_user_id, origin, username, phone_number, initial_credits, created_at))
+
+    def get_user_credits(self, user_id):
+        row = self._connection().execute("SELECT credits FROM User WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def reserve_credit(self, user_id, amount=1):
+        cursor = self._connection().execute(
+            "UPDATE User SET credits = credits - ? WHERE user_id = ? AND credits >= ?",
+            (amount, user_id, amount)
+        )
+        return cursor.rowcount == 1
+
+    def refund_credit(self, user_id, amount=1):
+        self._connection().execute("UPDATE User SET credits = credits + ? WHERE user_id = ?", (amount, user_id))
+
+    def check_rate_limit(self, user_id, interval_seconds):
+        now = time.time()
+        # The upsert only overwrites rows that are old enough, so rowcount tells us who won.
+        cursor = self._connection().execute('''
+            INSERT INTO RateLimit (user_id, last_at) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_at = excluded.last_at
+            WHERE RateLimit.last_at <= ?
+        ''', (user_id, now, now - interval_seconds))
+        return cursor.rowcount == 1
+
+    def clear_rate_limit(self, user_id):
+        self._connection().execute("DELETE FROM RateLimit WHERE user_id = ?", (user_id,))
+
+    def get_cached_response(self, question, service):
+        current_time = datetime.datetime.now().isoformat()
+        row = self._connection().execute(
+            "SELECT response FROM Cache WHERE question = ? AND service = ? AND expires_at > ? ORDER BY expires_at DESC LIMIT 1",
+            (question, service, current_time)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store_cached_response(self, question, response, service, expires_in_seconds=300):
+        created_at = datetime.datetime.now()
+        expires_at = created_at + datetime.timedelta(seconds=expires_in_seconds)
+        self._connection().execute('''
+            INSERT INTO Cache (question, response, service, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (question, response, service, created_at.isoformat(), expires_at.isoformat()))
+
+    def complete_payment(self, payment_id, credits):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            completed_at = datetime.datetime.now().isoformat()
+            cursor = conn.execute('''
+                UPDATE Payment SET payment_status = 'completed', completed_at = ?
+                WHERE payment_id = ? AND payment_status != 'completed'
+            ''', (completed_at, payment_id))
+            if cursor.rowcount != 1:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute('''
+                UPDATE User SET credits = credits + ?
+                WHERE user_id = (SELECT user_id FROM Payment WHERE payment_id = ?)
+            ''', (credits, payment_id))
+            conn.execute("COMMIT")
+            return True
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
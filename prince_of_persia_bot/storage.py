@@ -0,0 +1,776 @@
+import time
+import datetime
+import collections
+
+from config import STORAGE_BACKEND
+from shared_state import SharedState, InMemorySharedState, SQLiteSharedState
+
+# SQLite refuses statements with more than 999 variables on older builds.
+SQLITE_MAX_VARIABLES = 900
+
+MESSAGE_FIELDS = ("user_id", "text", "enhanced_text", "gemini_response", "deepseek_response", "response_text", "timestamp", "response_timestamp", "cache_hit", "prompt_tokens", "output_tokens", "model")
+# Message fields that may be left out; cached answers cost no tokens and have no model.
+MESSAGE_DEFAULTS = {"cache_hit": False, "prompt_tokens": 0, "output_tokens": 0, "model": None}
+
+# TokenUsage row holding the total of all users for the day.
+ALL_USERS = "*"
+
+
+class AlreadyJournaled(Exception):
+    """Raised by reserve_request for a request that is already journaled, i.e. the same update handled twice."""
+
+    def __init__(self, request_id):
+        super().__init__(f"request {request_id} is already journaled")
+        self.request_id = request_id
+
+
+class Storage(SharedState):
+    """
+    Repository interface for everything the bot persists.
+
+    Rows are returned as tuples in the same column order as the SQLite engine's queries,
+    so callers can switch between engines without changing how they unpack results.
+    """
+
+    # Users: (user_id, platform_user_id, origin, username, phone_number, credits, created_at)
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_users_many(self, user_ids):
+        """Returns a dict of user_id -> user row for the ids that exist."""
+        raise NotImplementedError
+
+    def get_user_phone_number(self, user_id):
+        raise NotImplementedError
+
+    def update_user_phone_number(self, user_id, phone_number):
+        raise NotImplementedError
+
+    def add_credits_to_user(self, user_id, credits):
+        self.refund_credit(user_id, credits)
+
+    def get_user_chats_after(self, after_user_id, limit):
+        """
+        Returns up to `limit` (user_id, platform_user_id) pairs ordered by user_id, starting after
+        `after_user_id` (None for the first page). Keyset pagination keeps each page cheap.
+        """
+        raise NotImplementedError
+
+    # Plans: (plan_id, name, price, credits, description)
+
+    def add_plan(self, name, price, credits, description=None):
+        raise NotImplementedError
+
+    def get_all_plans(self):
+        raise NotImplementedError
+
+    def get_plan_by_id(self, plan_id):
+        raise NotImplementedError
+
+    # Payments: (payment_id, user_id, plan_id, amount, payment_status)
+
+    def add_payment(self, user_id, plan_id, amount, payment_status="pending", authority=None):
+        """Returns the new payment_id."""
+        raise NotImplementedError
+
+    def update_payment_status(self, payment_id, payment_status, completed_at=None):
+        raise NotImplementedError
+
+    def get_payment_details(self, payment_id):
+        raise NotImplementedError
+
+    def has_completed_payment(self, user_id):
+        """True if the user has ever completed a purchase."""
+        raise NotImplementedError
+
+    # Transactions: (payment_id, transaction_id, amount, provider_status, provider_response)
+
+    def add_transaction(self, payment_id, transaction_id, amount, provider_status, provider_response=None):
+        raise NotImplementedError
+
+    def get_transaction(self, payment_id):
+        raise NotImplementedError
+
+    # Messages
+
+    def add_message(self, user_id, text, enhanced_text, gemini_response, deepseek_response, response_text, timestamp, response_timestamp, cache_hit=False,
+                    prompt_tokens=0, output_tokens=0, model=None):
+        self.add_messages_many([{
+            "user_id": user_id,
+            "text": text,
+            "enhanced_text": enhanced_text,
+            "gemini_response": gemini_response,
+            "deepseek_response": deepseek_response,
+            "response_text": response_text,
+            "timestamp": timestamp,
+            "response_timestamp": response_timestamp,
+            "cache_hit": cache_hit,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "model": model,
+        }])
+
+    def add_messages_many(self, messages):
+        """Stores a list of message dicts (keys as in MESSAGE_FIELDS, those in MESSAGE_DEFAULTS optional) in one write."""
+        raise NotImplementedError
+
+    def get_last_message_timestamp(self, user_id):
+        raise NotImplementedError
+
+    def get_popular_questions(self, since, limit):
+        """Returns up to `limit` (text, count) pairs for messages since the ISO timestamp `since`, most asked first."""
+        raise NotImplementedError
+
+    # Pending requests: (request_id, user_id, chat_id, text, asked_at, status)
+    # A question's credits are journaled here from the moment they are taken until its
+    # Message is stored, so a shutdown or crash in between loses neither.
+
+    def reserve_request(self, request_id, user_id, chat_id, text, asked_at, credits=1):
+        """
+        Takes `credits` from the user and journals the request as 'reserved', atomically.
+
+        Returns False if the user doesn't have enough credits. Raises AlreadyJournaled,
+        without charging anything, if the request is already journaled.
+        """
+        raise NotImplementedError
+
+    def settle_request(self, request_id, message):
+        """Stores the answered `message` (a dict as for add_messages_many) and drops the journal entry, atomically."""
+        raise NotImplementedError
+
+    def release_request(self, request_id, keep=False):
+        """
+        Refunds a request's credits if they are still reserved and drops its journal entry.
+
+        With `keep`, the entry stays behind as 'interrupted' so the question can be answered
+        after the next boot. Does nothing for requests that are not journaled.
+        """
+        raise NotImplementedError
+
+    def get_unfinished_requests(self, before):
+        """Returns requests journaled before the epoch time `before`, i.e. left over from an earlier run."""
+        raise NotImplementedError
+
+    # Token usage
+
+    def add_token_usage(self, day, user_id, model, prompt_tokens, output_tokens):
+        """
+        Records one Gemini call on `day`, atomically: its tokens count towards the user's and
+        the overall budget, and towards the model's usage. `user_id` None counts towards the total only.
+        """
+        raise NotImplementedError
+
+    def get_token_usage(self, day, user_id=None):
+        """Returns (user's tokens, all users' tokens) used on `day`."""
+        raise NotImplementedError
+
+    def get_model_usage(self, day):
+        """Returns (model, requests, prompt tokens, output tokens) rows for `day`."""
+        raise NotImplementedError
+
+    # Update de-duplication
+
+    def get_update_watermark(self, name):
+        """Returns (update_id, saved_at epoch seconds) or None."""
+        raise NotImplementedError
+
+    def save_update_watermark(self, name, update_id):
+        raise NotImplementedError
+
+    # Reply rates of the worker processes
+
+    def save_reply_rate(self, worker, rate):
+        raise NotImplementedError
+
+    def get_reply_rate(self, since, exclude=None):
+        """Returns the summed rates saved at or after the epoch time `since` by workers other than `exclude`."""
+        raise NotImplementedError
+
+    # Cache (get_cached_response and store_cached_response come from SharedState)
+
+    def get_cache_entry(self, question, service):
+        """Returns (response, expires_at datetime) for the freshest unexpired entry, or None."""
+        raise NotImplementedError
+
+    def delete_expired_cache(self):
+        raise NotImplementedError
+
+    # API keys
+
+    def add_api_key(self, service_name, api_key_value):
+        raise NotImplementedError
+
+    def get_api_key(self, service_name):
+        """Returns the most recently added key for the service, or None."""
+        raise NotImplementedError
+
+    # Broadcasts: (broadcast_id, text, status, last_user_id, sent_count, failed_count)
+
+    def create_broadcast(self, text):
+        """Queues a broadcast with status 'pending' and returns its broadcast_id."""
+        raise NotImplementedError
+
+    def get_broadcast(self, broadcast_id):
+        raise NotImplementedError
+
+    def get_unfinished_broadcasts(self):
+        """Returns broadcasts that are 'pending' or 'running', oldest first."""
+        raise NotImplementedError
+
+    def claim_broadcast(self, broadcast_id):
+        """Moves a broadcast from 'pending' to 'running'. Returns True only for the caller that won."""
+        raise NotImplementedError
+
+    def save_broadcast_progress(self, broadcast_id, status, last_user_id, sent_count, failed_count):
+        raise NotImplementedError
+
+
+class MemoryStorage(InMemorySharedState, Storage):
+    """Keeps every table in process memory. Fast, but nothing survives a restart."""
+
+    def __init__(self):
+        super().__init__()
+        self._plans = {}
+        self._transactions = {}
+        self._messages = []
+        self._api_keys = {}
+        self._broadcasts = {}
+        self._pending = {}
+        self._update_watermarks = {}
+        self._reply_rates = {}  # worker -> (rate, saved_at)
+        self._token_usage = collections.Counter()  # (day, user_id) -> tokens
+        self._model_usage = {}  # (day, model) -> (requests, prompt tokens, output tokens)
+        self._next_id = {"plan": 1, "payment": 1, "broadcast": 1}
+
+    def _user_row(self, user_id):
+        user = self._users[user_id]
+        return (user_id, user["platform_user_id"], user["origin"], user["username"],
+                user["phone_number"], user["credits"], user["created_at"])
+
+    def get_user(self, user_id):
+        with self._lock:
+            return self._user_row(user_id) if user_id in self._users else None
+
+    def get_users_many(self, user_ids):
+        with self._lock:
+            return {user_id: self._user_row(user_id) for user_id in user_ids if user_id in self._users}
+
+    def get_user_phone_number(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return (user["phone_number"] or None) if user else None
+
+    def update_user_phone_number(self, user_id, phone_number):
+        with self._lock:
+            if user_id in self._users:
+                self._users[user_id]["phone_number"] = phone_number
+
+    def get_user_chats_after(self, after_user_id, limit):
+        with self._lock:
+            user_ids = sorted(user_id for user_id in self._users if after_user_id is None or user_id > after_user_id)
+            return [(user_id, self._users[user_id]["platform_user_id"]) for user_id in user_ids[:limit]]
+
+    def add_plan(self, name, price, credits, description=None):
+        with self._lock:
+            plan_id = self._next_id["plan"]
+            self._next_id["plan"] += 1
+            self._plans[plan_id] = (plan_id, name, price, credits, description)
+            return plan_id
+
+    def get_all_plans(self):
+        with self._lock:
+            return list(self._plans.values())
+
+    def get_plan_by_id(self, plan_id):
+        with self._lock:
+            return self._plans.get(plan_id)
+
+    def add_payment(self, user_id, plan_id, amount, payment_status="pending", authority=None):
+        with self._lock:
+            payment_id = self._next_id["payment"]
+            self._next_id["payment"] += 1
+            self._payments[payment_id] = {
+                "user_id": user_id,
+                "plan_id": plan_id,
+                "amount": amount,
+                "payment_status": payment_status,
+                "authority": authority,
+                "created_at": datetime.datetime.now().isoformat(),
+                "completed_at": None,
+            }
+            return payment_id
+
+    def update_payment_status(self, payment_id, payment_status, completed_at=None):
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment:
+                payment["payment_status"] = payment_status
+                payment["completed_at"] = completed_at or datetime.datetime.now().isoformat()
+
+    def get_payment_details(self, payment_id):
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if not payment:
+                return None
+            return (payment_id, payment["user_id"], payment["plan_id"], payment["amount"], payment["payment_status"])
+
+    def has_completed_payment(self, user_id):
+        with self._lock:
+            return any(p["user_id"] == user_id and p["payment_status"] == "completed" for p in self._payments.values())
+
+    def add_transaction(self, payment_id, transaction_id, amount, provider_status, provider_response=None):
+        with self._lock:
+            self._transactions[payment_id] = (payment_id, transaction_id, amount, provider_status, provider_response)
+
+    def get_transaction(self, payment_id):
+        with self._lock:
+            return self._transactions.get(payment_id)
+
+    def add_messages_many(self, messages):
+        with self._lock:
+            for message in messages:
+                self._messages.append(dict(MESSAGE_DEFAULTS, **message, message_id=len(self._messages) + 1))
+
+    def get_last_message_timestamp(self, user_id):
+        with self._lock:
+            timestamps = [m["timestamp"] for m in self._messages if m["user_id"] == user_id]
+            return max(timestamps) if timestamps else None
+
+    def get_popular_questions(self, since, limit):
+        with self._lock:
+            counts = collections.Counter(m["text"] for m in self._messages if m["timestamp"] >= since)
+            return counts.most_common(limit)
+
+    def reserve_request(self, request_id, user_id, chat_id, text, asked_at, credits=1):
+        with self._lock:
+            if request_id in self._pending:
+                raise AlreadyJournaled(request_id)
+            user = self._users.get(user_id)
+            if not user or user["credits"] < credits:
+                return False
+            user["credits"] -= credits
+            self._pending[request_id] = {
+                "user_id": user_id, "chat_id": chat_id, "text": text, "asked_at": asked_at,
+                "credits": credits, "status": "reserved", "reserved_at": time.time(),
+            }
+            return True
+
+    def settle_request(self, request_id, message):
+        with self._lock:
+            self._messages.append(dict(MESSAGE_DEFAULTS, **message, message_id=len(self._messages) + 1))
+            self._pending.pop(request_id, None)
+
+    def release_request(self, request_id, keep=False):
+        with self._lock:
+            request = self._pending.get(request_id)
+            if not request:
+                return
+            if request["status"] == "reserved" and request["user_id"] in self._users:
+                self._users[request["user_id"]]["credits"] += request["credits"]
+            if keep:
+                request["status"] = "interrupted"
+            else:
+                del self._pending[request_id]
+
+    def get_unfinished_requests(self, before):
+        with self._lock:
+            pending = sorted(self._pending.items(), key=lambda item: item[1]["reserved_at"])
+            return [(request_id, r["user_id"], r["chat_id"], r["text"], r["asked_at"], r["status"])
+                    for request_id, r in pending if r["reserved_at"] < before]
+
+    def add_token_usage(self, day, user_id, model, prompt_tokens, output_tokens):
+        tokens = prompt_tokens + output_tokens
+        with self._lock:
+            if user_id is not None:
+                self._token_usage[(day, user_id)] += tokens
+            self._token_usage[(day, ALL_USERS)] += tokens
+            requests, prompt_total, output_total = self._model_usage.get((day, model), (0, 0, 0))
+            self._model_usage[(day, model)] = (requests + 1, prompt_total + prompt_tokens, output_total + output_tokens)
+
+    def get_token_usage(self, day, user_id=None):
+        with self._lock:
+            user_tokens = self._token_usage[(day, user_id)] if user_id is not None else 0
+            return user_tokens, self._token_usage[(day, ALL_USERS)]
+
+    def get_model_usage(self, day):
+        with self._lock:
+            return sorted((model, *totals) for (usage_day, model), totals in self._model_usage.items() if usage_day == day)
+
+    def get_update_watermark(self, name):
+        with self._lock:
+            return self._update_watermarks.get(name)
+
+    def save_update_watermark(self, name, update_id):
+        with self._lock:
+            self._update_watermarks[name] = (update_id, time.time())
+
+    def save_reply_rate(self, worker, rate):
+        with self._lock:
+            self._reply_rates[worker] = (rate, time.time())
+
+    def get_reply_rate(self, since, exclude=None):
+        with self._lock:
+            return sum(rate for worker, (rate, saved_at) in self._reply_rates.items()
+                       if saved_at >= since and worker != exclude)
+
+    def get_cache_entry(self, question, service):
+        with self._lock:
+            entry = self._cache.get((question, service))
+            if entry and entry[1] > time.time():
+                return entry[0], datetime.datetime.fromtimestamp(entry[1])
+            return None
+
+    def delete_expired_cache(self):
+        with self._lock:
+            now = time.time()
+            for key in [key for key, entry in self._cache.items() if entry[1] <= now]:
+                del self._cache[key]
+
+    def add_api_key(self, service_name, api_key_value):
+        with self._lock:
+            self._api_keys[service_name] = api_key_value
+
+    def get_api_key(self, service_name):
+        with self._lock:
+            return self._api_keys.get(service_name)
+
+    def create_broadcast(self, text):
+        with self._lock:
+            broadcast_id = self._next_id["broadcast"]
+            self._next_id["broadcast"] += 1
+            self._broadcasts[broadcast_id] = (broadcast_id, text, "pending", None, 0, 0)
+            return broadcast_id
+
+    def get_broadcast(self, broadcast_id):
+        with self._lock:
+            return self._broadcasts.get(broadcast_id)
+
+    def get_unfinished_broadcasts(self):
+        with self._lock:
+            return [b for b in sorted(self._broadcasts.values()) if b[2] in ("pending", "running")]
+
+    def claim_broadcast(self, broadcast_id):
+        with self._lock:
+            broadcast = self._broadcasts.get(broadcast_id)
+            if not broadcast or broadcast[2] != "pending":
+                return False
+            self._broadcasts[broadcast_id] = broadcast[:2] + ("running",) + broadcast[3:]
+            return True
+
+    def save_broadcast_progress(self, broadcast_id, status, last_user_id, sent_count, failed_count):
+        with self._lock:
+            text = self._broadcasts[broadcast_id][1]
+            self._broadcasts[broadcast_id] = (broadcast_id, text, status, last_user_id, sent_count, failed_count)
+
+
+class SQLiteStorage(SQLiteSharedState, Storage):
+    """The bot database file, shared safely between worker processes (see SQLiteSharedState)."""
+
+    def get_user(self, user_id):
+        return self._connection().execute('''
+            SELECT user_id, platform_user_id, origin, username, phone_number, credits, created_at
+            FROM User WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+
+    def get_users_many(self, user_ids):
+        user_ids = list(user_ids)
+        users = {}
+        conn = self._connection()
+        for start in range(0, len(user_ids), SQLITE_MAX_VARIABLES):
+            chunk = user_ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(f'''
+                SELECT user_id, platform_user_id, origin, username, phone_number, credits, created_at
+                FROM User WHERE user_id IN ({placeholders})
+            ''', chunk).fetchall()
+            users.update((row[0], row) for row in rows)
+        return users
+
+    def get_user_phone_number(self, user_id):
+        row = self._connection().execute("SELECT phone_number FROM User WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row and row[0] else None
+
+    def update_user_phone_number(self, user_id, phone_number):
+        self._connection().execute("UPDATE User SET phone_number = ? WHERE user_id = ?", (phone_number, user_id))
+
+    def get_user_chats_after(self, after_user_id, limit):
+        return self._connection().execute(
+            "SELECT user_id, platform_user_id FROM User WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_user_id or "", limit)
+        ).fetchall()
+
+    def add_plan(self, name, price, credits, description=None):
+        created_at = datetime.datetime.now().isoformat()
+        cursor = self._connection().execute('''
+            INSERT INTO Plan (name, price, credits, description, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, price, credits, description, created_at, created_at))
+        return cursor.lastrowid
+
+    def get_all_plans(self):
+        return self._connection().execute("SELECT plan_id, name, price, credits, description FROM Plan").fetchall()
+
+    def get_plan_by_id(self, plan_id):
+        return self._connection().execute(
+            "SELECT plan_id, name, price, credits, description FROM Plan WHERE plan_id = ?", (plan_id,)
+        ).fetchone()
+
+    def add_payment(self, user_id, plan_id, amount, payment_status="pending", authority=None):
+        created_at = datetime.datetime.now().isoformat()
+        cursor = self._connection().execute('''
+            INSERT INTO Payment (user_id, plan_id, amount, payment_status, created_at, authority)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, plan_id, amount, payment_status, created_at, authority))
+        return cursor.lastrowid
+
+    def update_payment_status(self, payment_id, payment_status, completed_at=None):
+        completed_at = completed_at or datetime.datetime.now().isoformat()
+        self._connection().execute(
+            "UPDATE Payment SET payment_status = ?, completed_at = ? WHERE payment_id = ?",
+            (payment_status, completed_at, payment_id)
+        )
+
+    def get_payment_details(self, payment_id):
+        return self._connection().execute(
+            "SELECT payment_id, user_id, plan_id, amount, payment_status FROM Payment WHERE payment_id = ?", (payment_id,)
+        ).fetchone()
+
+    def has_completed_payment(self, user_id):
+        row = self._connection().execute(
+            "SELECT 1 FROM Payment WHERE user_id = ? AND payment_status = 'completed' LIMIT 1", (user_id,)
+        ).fetchone()
+        return row is not None
+
+    def add_transaction(self, payment_id, transaction_id, amount, provider_status, provider_response=None):
+        created_at = datetime.datetime.now().isoformat()
+        self._connection().execute('''
+            INSERT INTO "Transaction" (payment_id, transaction_id, amount, provider_status, provider_response, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (payment_id, transaction_id, amount, provider_status, provider_response, created_at, created_at))
+
+    def get_transaction(self, payment_id):
+        return self._connection().execute('''
+            SELECT payment_id, transaction_id, amount, provider_status, provider_response
+            FROM "Transaction" WHERE payment_id = ?
+        ''', (payment_id,)).fetchone()
+
+    def _message_row(self, message):
+        message = dict(MESSAGE_DEFAULTS, **message)
+        message["cache_hit"] = int(bool(message["cache_hit"]))
+        return tuple(message[field] for field in MESSAGE_FIELDS)
+
+    def _insert_messages(self, conn, messages):
+        conn.executemany(f'''
+            INSERT INTO Message ({", ".join(MESSAGE_FIELDS)})
+            VALUES ({", ".join("?" * len(MESSAGE_FIELDS))})
+        ''', [self._message_row(message) for message in messages])
+
+    def add_messages_many(self, messages):
+        if not messages:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert_messages(conn, messages)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_last_message_timestamp(self, user_id):
+        row = self._connection().execute(
+            "SELECT timestamp FROM Message WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_popular_questions(self, since, limit):
+        return self._connection().execute('''
+            SELECT text, COUNT(*) FROM Message WHERE timestamp >= ?
+            GROUP BY text ORDER BY COUNT(*) DESC LIMIT ?
+        ''', (since, limit)).fetchall()
+
+    def reserve_request(self, request_id, user_id, chat_id, text, asked_at, credits=1):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            journaled = conn.execute('''
+                INSERT INTO PendingRequest (request_id, user_id, chat_id, text, asked_at, credits, status, reserved_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'reserved', ?)
+                ON CONFLICT(request_id) DO NOTHING
+            ''', (request_id, user_id, chat_id, text, asked_at, credits, time.time())).rowcount == 1
+            charged = journaled and conn.execute(
+                "UPDATE User SET credits = credits - ? WHERE user_id = ? AND credits >= ?",
+                (credits, user_id, credits)
+            ).rowcount == 1
+            conn.execute("COMMIT" if charged else "ROLLBACK")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not journaled:
+            raise AlreadyJournaled(request_id)
+        return charged
+
+    def settle_request(self, request_id, message):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert_messages(conn, [message])
+            conn.execute("DELETE FROM PendingRequest WHERE request_id = ?", (request_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release_request(self, request_id, keep=False):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT user_id, credits, status FROM PendingRequest WHERE request_id = ?", (request_id,)
+            ).fetchone()
+            if row:
+                user_id, credits, status = row
+                if status == "reserved":
+                    conn.execute("UPDATE User SET credits = credits + ? WHERE user_id = ?", (credits, user_id))
+                if keep:
+                    conn.execute("UPDATE PendingRequest SET status = 'interrupted' WHERE request_id = ?", (request_id,))
+                else:
+                    conn.execute("DELETE FROM PendingRequest WHERE request_id = ?", (request_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_unfinished_requests(self, before):
+        return self._connection().execute('''
+            SELECT request_id, user_id, chat_id, text, asked_at, status FROM PendingRequest
+            WHERE reserved_at < ? ORDER BY reserved_at
+        ''', (before,)).fetchall()
+
+    def add_token_usage(self, day, user_id, model, prompt_tokens, output_tokens):
+        tokens = prompt_tokens + output_tokens
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany('''
+                INSERT INTO TokenUsage (day, user_id, tokens) VALUES (?, ?, ?)
+                ON CONFLICT(day, user_id) DO UPDATE SET tokens = tokens + excluded.tokens
+            ''', [(day, row_user_id, tokens) for row_user_id in (user_id, ALL_USERS) if row_user_id is not None])
+            conn.execute('''
+                INSERT INTO ModelUsage (day, model, requests, prompt_tokens, output_tokens) VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT(day, model) DO UPDATE SET requests = requests + 1,
+                                                      prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                                                      output_tokens = output_tokens + excluded.output_tokens
+            ''', (day, model, prompt_tokens, output_tokens))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_token_usage(self, day, user_id=None):
+        rows = dict(self._connection().execute(
+            "SELECT user_id, tokens FROM TokenUsage WHERE day = ? AND user_id IN (?, ?)", (day, user_id, ALL_USERS)
+        ).fetchall())
+        return rows.get(user_id, 0) if user_id is not None else 0, rows.get(ALL_USERS, 0)
+
+    def get_model_usage(self, day):
+        return self._connection().execute(
+            "SELECT model, requests, prompt_tokens, output_tokens FROM ModelUsage WHERE day = ? ORDER BY model", (day,)
+        ).fetchall()
+
+    def get_update_watermark(self, name):
+        return self._connection().execute(
+            "SELECT update_id, saved_at FROM UpdateWatermark WHERE name = ?", (name,)
+        ).fetchone()
+
+    def save_update_watermark(self, name, update_id):
+        self._connection().execute('''
+            INSERT INTO UpdateWatermark (name, update_id, saved_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET update_id = excluded.update_id, saved_at = excluded.saved_at
+        ''', (name, update_id, time.time()))
+
+    def save_reply_rate(self, worker, rate):
+        self._connection().execute('''
+            INSERT INTO ReplyRate (worker, rate, saved_at) VALUES (?, ?, ?)
+            ON CONFLICT(worker) DO UPDATE SET rate = excluded.rate, saved_at = excluded.saved_at
+        ''', (worker, rate, time.time()))
+
+    def get_reply_rate(self, since, exclude=None):
+        return self._connection().execute(
+            "SELECT COALESCE(SUM(rate), 0) FROM ReplyRate WHERE saved_at >= ? AND worker IS NOT ?", (since, exclude)
+        ).fetchone()[0]
+
+    def get_cache_entry(self, question, service):
+        current_time = datetime.datetime.now().isoformat()
+        row = self._connection().execute(
+            "SELECT response, expires_at FROM Cache WHERE question = ? AND service = ? AND expires_at > ? ORDER BY expires_at DESC LIMIT 1",
+            (question, service, current_time)
+        ).fetchone()
+        return (row[0], datetime.datetime.fromisoformat(row[1])) if row else None
+
+    def delete_expired_cache(self):
+        current_time = datetime.datetime.now().isoformat()
+        self._connection().execute("DELETE FROM Cache WHERE expires_at <= ?", (current_time,))
+
+    def add_api_key(self, service_name, api_key_value):
+        created_at = datetime.datetime.now().isoformat()
+        self._connection().execute('''
+            INSERT INTO API_Key (service_name, api_key_value, created_at, updated_at)
+            VALUES (?, ?, ?, ?)
+        ''', (service_name, api_key_value, created_at, created_at))
+
+    def get_api_key(self, service_name):
+        row = self._connection().execute(
+            "SELECT api_key_value FROM API_Key WHERE service_name = ? ORDER BY api_key_id DESC LIMIT 1", (service_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def create_broadcast(self, text):
+        created_at = datetime.datetime.now().isoformat()
+        cursor = self._connection().execute('''
+            INSERT INTO Broadcast (text, status, last_user_id, sent_count, failed_count, created_at, updated_at)
+            VALUES (?, 'pending', NULL, 0, 0, ?, ?)
+        ''', (text, created_at, created_at))
+        return cursor.lastrowid
+
+    def get_broadcast(self, broadcast_id):
+        return self._connection().execute(
+            "SELECT broadcast_id, text, status, last_user_id, sent_count, failed_count FROM Broadcast WHERE broadcast_id = ?",
+            (broadcast_id,)
+        ).fetchone()
+
+    def get_unfinished_broadcasts(self):
+        return self._connection().execute('''
+            SELECT broadcast_id, text, status, last_user_id, sent_count, failed_count FROM Broadcast
+            WHERE status IN ('pending', 'running') ORDER BY broadcast_id
+        ''').fetchall()
+
+    def claim_broadcast(self, broadcast_id):
+        updated_at = datetime.datetime.now().isoformat()
+        cursor = self._connection().execute(
+            "UPDATE Broadcast SET status = 'running', updated_at = ? WHERE broadcast_id = ? AND status = 'pending'",
+            (updated_at, broadcast_id)
+        )
+        return cursor.rowcount == 1
+
+    def save_broadcast_progress(self, broadcast_id, status, last_user_id, sent_count, failed_count):
+        updated_at = datetime.datetime.now().isoformat()
+        self._connection().execute('''
+            UPDATE Broadcast SET status = ?, last_user_id = ?, sent_count = ?, failed_count = ?, updated_at = ?
+            WHERE broadcast_id = ?
+        ''', (status, last_user_id, sent_count, failed_count, updated_at, broadcast_id))
+
+
+_STORAGE_ENGINES = {
+    "memory": MemoryStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def get_storage(backend=None):
+    """Builds the storage engine selected by STORAGE_BACKEND."""
+    backend = backend or STORAGE_BACKEND
+    if backend not in _STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return _STORAGE_ENGINES[backend]()
@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionController, Overloaded
+
+
+class FakeStorage:
+    def __init__(self, paid=()):
+        self.paid = set(paid)
+        self.lookups = 0
+
+    def has_completed_payment(self, user_id):
+        self.lookups += 1
+        return user_id in self.paid
+
+
+def _controller(max_concurrency=1, paid=1, free=1, queue_size=10, max_wait_seconds=5, paid_users=("p1", "p2", "p3")):
+    return AdmissionController(FakeStorage(paid_users), max_concurrency=max_concurrency,
+                               class_limits={"paid": paid, "free": free}, queue_size=queue_size,
+                               max_wait_seconds=max_wait_seconds)
+
+
+async def _request(controller, user_id, order, release):
+    async with controller.admit(user_id):
+        order.append(user_id)
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_paid_served_before_free():
+    async def main():
+        controller = _controller()
+        order = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_request(controller, user_id, order, release)) for user_id in ("f1", "f2", "p1")]
+        await _settle()
+        assert order == ["f1"]
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["f1", "p1", "f2"]
+
+
+def test_class_and_global_caps():
+    async def main():
+        controller = _controller(max_concurrency=3, paid=2, free=1)
+        order = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_request(controller, user_id, order, release))
+                 for user_id in ("f1", "f2", "p1", "p2", "p3")]
+        await _settle()
+        # f2 waits for the free cap, p3 for the global one.
+        assert order == ["f1", "p1", "p2"]
+        metrics = controller.metrics()
+        assert (metrics["free"]["active"], metrics["free"]["waiting"]) == (1, 1)
+        assert (metrics["paid"]["active"], metrics["paid"]["waiting"]) == (2, 1)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.metrics()["free"]["active"] == controller.metrics()["paid"]["active"] == 0
+        return order
+
+    assert sorted(asyncio.run(main())[3:]) == ["f2", "p3"]
+
+
+def test_paid_request_pushes_out_newest_free_waiter():
+    async def main():
+        controller = _controller(queue_size=2)
+        order = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_request(controller, user_id, order, release)) for user_id in ("f1", "f2", "f3")]
+        await _settle()
+        tasks.append(asyncio.create_task(_request(controller, "p1", order, release)))
+        await _settle()
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return order, results, controller.metrics()
+
+    order, results, metrics = asyncio.run(main())
+    assert order == ["f1", "p1", "f2"]
+    assert isinstance(results[2], Overloaded)
+    assert metrics["free"]["shed"] == 1
+
+
+def test_full_queue_sheds_same_priority():
+    async def main():
+        controller = _controller(queue_size=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_request(controller, user_id, [], release)) for user_id in ("f1", "f2")]
+        await _settle()
+        with pytest.raises(Overloaded):
+            await _request(controller, "f3", [], release)
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_waiting_too_long_is_shed():
+    async def main():
+        controller = _controller(max_wait_seconds=0.01)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_request(controller, "f1", [], release))
+        await _settle()
+        with pytest.raises(Overloaded):
+            await _request(controller, "f2", [], release)
+        release.set()
+        await holder
+        return controller.metrics()
+
+    metrics = asyncio.run(main())
+    assert (metrics["free"]["admitted"], metrics["free"]["shed"], metrics["free"]["waiting"]) == (1, 1, 0)
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        controller = _controller()
+        order = []
+        release = asyncio.Event()
+        holder = asyncio.create_task(_request(controller, "f1", order, release))
+        await _settle()
+        waiter = asyncio.create_task(_request(controller, "f2", order, release))
+        await _settle()
+        waiter.cancel()
+        await _settle()
+        assert controller.metrics()["free"]["waiting"] == 0
+        release.set()
+        await holder
+        await _request(controller, "f3", order, release)
+        return order, controller.metrics()
+
+    order, metrics = asyncio.run(main())
+    assert order == ["f1", "f3"]
+    assert metrics["free"]["active"] == 0
+
+
+def test_waiter_cancelled_right_after_getting_a_slot_gives_it_back():
+    async def main():
+        controller = _controller()
+        release = asyncio.Event()
+        order = []
+        release.set()
+        async with controller.admit("f1"):
+            waiter = asyncio.create_task(_request(controller, "f2", order, release))
+            await _settle()
+        # Leaving the block handed the slot to the waiter, which hasn't run since.
+        waiter.cancel()
+        results = await asyncio.gather(waiter, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert order == []
+        return controller.metrics()
+
+    metrics = asyncio.run(main())
+    assert (metrics["free"]["active"], metrics["free"]["waiting"]) == (0, 0)
+
+
+def test_metrics_counters(monkeypatch):
+    async def main():
+        controller = _controller(max_concurrency=2, paid=2, free=2)
+        release = asyncio.Event()
+        release.set()
+        for user_id in ("p1", "f1", "f2"):
+            await _request(controller, user_id, [], release)
+        return controller.metrics()
+
+    metrics = asyncio.run(main())
+    assert metrics["paid"]["admitted"] == 1
+    assert metrics["free"]["admitted"] == 2
+    assert metrics["free"]["limit"] == 2
+    assert metrics["queue_size"] == 10 and metrics["max_concurrency"] == 2
+    assert metrics["free"]["avg_wait_seconds"] >= 0.0
+
+
+def test_priority_cache_is_pruned(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    controller = AdmissionController(FakeStorage(), priority_ttl_seconds=10)
+    for user_id in range(100):
+        controller.class_for(user_id)
+    controller.class_for(0)
+    assert controller.storage.lookups == 100
+    now[0] += 11
+    controller.class_for("new")
+    assert list(controller._priority_cache) == ["new"]
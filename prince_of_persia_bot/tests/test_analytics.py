@@ -0,0 +1,77 @@
+import sqlite3
+import datetime
+
+import pytest
+
+import analytics
+from budget import TokenBudget, today
+from database import ensure_schema
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def files(tmp_path):
+    database_file = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(database_file, isolation_level=None)
+    ensure_schema(conn)
+    conn.close()
+    return database_file, str(tmp_path / "analytics.db")
+
+
+def _utc_days_ago(days):
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+
+
+def test_utc_day():
+    assert analytics.utc_day("2026-03-01T23:30:00-02:00") == "2026-03-02"
+    assert analytics.utc_day("2026-03-01T01:00:00+03:30") == "2026-02-28"
+    assert analytics.utc_day("") == ""
+    local = datetime.datetime(2026, 3, 1, 12)
+    assert analytics.utc_day(local.isoformat()) == local.astimezone(datetime.timezone.utc).date().isoformat()
+
+
+def test_revenue_only_days_are_reported(files):
+    database_file, analytics_file = files
+    asked = _utc_days_ago(1)
+    paid = _utc_days_ago(0)
+    conn = sqlite3.connect(database_file)
+    conn.execute("INSERT INTO Message (user_id, text, timestamp, cache_hit, prompt_tokens, output_tokens, model) "
+                 "VALUES ('u1', 'salam', ?, 0, 10, 20, 'm')", (asked.isoformat(),))
+    conn.execute("INSERT INTO ModelUsage VALUES (?, 'm', 1, 10, 20)", (asked.date().isoformat(),))
+    # completed_at is written in local time by the bot.
+    conn.execute("INSERT INTO Payment (user_id, plan_id, amount, payment_status, completed_at) "
+                 "VALUES ('u1', 1, 10, 'completed', ?)", (paid.astimezone().replace(tzinfo=None).isoformat(),))
+    conn.commit()
+    conn.close()
+
+    assert analytics.refresh(database_file, analytics_file) == (1, 1, 1)
+    daily, per_plan, token_usage = analytics.report(analytics_file, days=2)
+    assert daily == [
+        (asked.date().isoformat(), 1, 1, 0, 0),
+        (paid.date().isoformat(), 0, 0, 0, 10),
+    ]
+    assert per_plan == [(1, 1, 10)]
+    assert token_usage == [(asked.date().isoformat(), "m", 1, 10, 20)]
+
+
+def test_token_report_includes_calls_without_messages(files):
+    database_file, analytics_file = files
+    storage = SQLiteStorage(database_file)
+    budget = TokenBudget(storage)
+    # An answered question, a cache refresh and an empty answer: only the first has a Message.
+    budget.record("u1", "pro", 10, 20)
+    budget.record(None, "pro", 5, 15)
+    budget.record("u2", "lite", 7, 0)
+    storage.close()
+
+    analytics.refresh(database_file, analytics_file)
+    _, _, token_usage = analytics.report(analytics_file, days=1)
+    assert token_usage == [(today(), "lite", 1, 7, 0), (today(), "pro", 2, 15, 35)]
+
+    # Later calls on the same day replace the copied totals instead of adding to them.
+    storage = SQLiteStorage(database_file)
+    TokenBudget(storage).record("u1", "pro", 1, 1)
+    storage.close()
+    analytics.refresh(database_file, analytics_file)
+    _, _, token_usage = analytics.report(analytics_file, days=1)
+    assert token_usage == [(today(), "lite", 1, 7, 0), (today(), "pro", 3, 16, 36)]
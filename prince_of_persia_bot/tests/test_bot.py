@@ -0,0 +1,174 @@
+import types
+import asyncio
+import datetime
+
+import bot
+from storage import MemoryStorage
+
+
+def test_duplicate_request_gets_no_reply(monkeypatch):
+    storage = MemoryStorage()
+    storage.add_user("u1", "1", "Telegram", initial_credits=5)
+    storage.reserve_request("100", "u1", 1, "salam", "2026-01-01T00:00:00+00:00")
+    monkeypatch.setattr(bot, "storage", storage)
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    asyncio.run(bot.answer_question("100", "u1", 1, "salam", "2026-01-01T00:00:00+00:00", send))
+    assert sent == []
+    assert storage.get_user_credits("u1") == 4
+
+
+def test_no_credits_reply(monkeypatch):
+    storage = MemoryStorage()
+    storage.add_user("u1", "1", "Telegram", initial_credits=0)
+    monkeypatch.setattr(bot, "storage", storage)
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    asyncio.run(bot.answer_question("100", "u1", 1, "salam", "2026-01-01T00:00:00+00:00", send))
+    assert sent == ["اعتبار شما کافی نیست. از /buyplan استفاده کنید."]
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text):
+        self.replies.append(text)
+
+
+class FakeBroadcaster:
+    def start(self, broadcast_id):
+        return asyncio.ensure_future(asyncio.sleep(0))
+
+
+def _broadcast(monkeypatch, text):
+    storage = MemoryStorage()
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "ADMIN_USER_IDS", {42})
+    message = FakeMessage(text)
+    update = types.SimpleNamespace(effective_user=types.SimpleNamespace(id=42), message=message)
+    context = types.SimpleNamespace(application=types.SimpleNamespace(bot_data={"broadcaster": FakeBroadcaster()}))
+
+    async def main():
+        await bot.broadcast_command(update, context)
+        await bot.lifecycle.stop_background()
+
+    asyncio.run(main())
+    return storage, message
+
+
+def test_broadcast_text_on_following_lines(monkeypatch):
+    storage, message = _broadcast(monkeypatch, "/broadcast\nسلام دوستان\nپلن جدید")
+    assert storage.get_broadcast(1)[1] == "سلام دوستان\nپلن جدید"
+    assert message.replies == ["ارسال همگانی 1 شروع شد."]
+
+
+def test_broadcast_text_on_same_line(monkeypatch):
+    storage, _ = _broadcast(monkeypatch, "/broadcast@prince_bot  سلام دوستان\nپلن جدید")
+    assert storage.get_broadcast(1)[1] == "سلام دوستان\nپلن جدید"
+
+
+def test_broadcast_without_text(monkeypatch):
+    storage, message = _broadcast(monkeypatch, "/broadcast\n  ")
+    assert storage.get_broadcast(1) is None
+    assert message.replies == ["استفاده: /broadcast <متن پیام>"]
+
+
+def _message_update(update_id, text):
+    message = FakeMessage(text)
+    message.date = datetime.datetime.now(datetime.timezone.utc)
+    return types.SimpleNamespace(update_id=update_id, message=message, effective_user=types.SimpleNamespace(id=7),
+                                 effective_chat=types.SimpleNamespace(id=7))
+
+
+def test_refused_question_does_not_start_cooldown(monkeypatch):
+    storage = MemoryStorage()
+    storage.add_user("7-0", "7", "Telegram", phone_number="+989120000000", initial_credits=0)
+    monkeypatch.setattr(bot, "storage", storage)
+    first, second = _message_update(1, "salam"), _message_update(2, "salam")
+    asyncio.run(bot.handle_message(first, None))
+    asyncio.run(bot.handle_message(second, None))
+    assert first.message.replies == second.message.replies == ["اعتبار شما کافی نیست. از /buyplan استفاده کنید."]
+
+
+def test_answered_question_starts_cooldown(monkeypatch):
+    storage = MemoryStorage()
+    storage.add_user("7-0", "7", "Telegram", phone_number="+989120000000", initial_credits=5)
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "response_cache", types.SimpleNamespace(get=lambda text: "answer"))
+    first, second = _message_update(1, "salam"), _message_update(2, "salam")
+    asyncio.run(bot.handle_message(first, None))
+    asyncio.run(bot.handle_message(second, None))
+    assert storage.get_user_credits("7-0") == 4
+    assert second.message.replies == ["لطفا بین ارسال پیام ها ۱۰ ثانیه صبر کنید."]
+
+
+def test_usage_recorded_when_handler_is_cancelled_during_the_call(monkeypatch):
+    import threading
+    from budget import TokenBudget, today
+
+    storage = MemoryStorage()
+    storage.add_user("u1", "1", "Telegram", initial_credits=5)
+    called, finish = threading.Event(), threading.Event()
+
+    def slow_gemini(text, model, max_output_tokens):
+        called.set()
+        finish.wait(5)
+        return {"candidates": [{"content": {"parts": [{"text": "answer"}]}}],
+                "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 20}}
+
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "token_budget", TokenBudget(storage))
+    monkeypatch.setattr(bot, "admission", bot.AdmissionController(storage))
+    monkeypatch.setattr(bot, "response_cache", types.SimpleNamespace(get=lambda text: None))
+    monkeypatch.setattr(bot, "get_gemini_response", slow_gemini)
+    message = FakeMessage("salam")
+
+    async def main():
+        task = asyncio.create_task(bot.answer_question("1", "u1", 1, "salam", "2026-01-01T00:00:00+00:00",
+                                                       message.reply_text))
+        await asyncio.to_thread(called.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        finish.set()
+        # The thread carries on after the handler is gone.
+        for _ in range(100):
+            if storage.get_token_usage(today(), "u1")[0]:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert storage.get_token_usage(today(), "u1") == (30, 30)
+    assert storage.get_user_credits("u1") == 5
+
+
+def test_ready_only_once_polling_and_application_run(monkeypatch):
+    from readiness import is_ready, mark_not_ready
+
+    monkeypatch.setattr(bot, "lifecycle", bot.Lifecycle())
+    application = types.SimpleNamespace(running=False, updater=types.SimpleNamespace(running=False))
+    mark_not_ready()
+
+    async def main():
+        task = asyncio.create_task(bot.report_ready(application, poll_interval=0.01))
+        await asyncio.sleep(0.05)
+        application.updater.running = True
+        await asyncio.sleep(0.05)
+        assert not is_ready()
+        application.running = True
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert is_ready()
+    mark_not_ready()
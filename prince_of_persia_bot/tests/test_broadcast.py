@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter, NetworkError
+
+import broadcast
+from broadcast import Broadcaster, InteractiveTraffic
+from storage import MemoryStorage
+
+# RetryAfter.retry_after warns about becoming a timedelta; _retry_after_seconds handles both.
+pytestmark = pytest.mark.filterwarnings("ignore::telegram.warnings.PTBDeprecationWarning")
+
+
+class FakeBot:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def _broadcaster(bot):
+    broadcaster = Broadcaster(bot, MemoryStorage(), rate=1000, traffic=InteractiveTraffic())
+    broadcaster.bucket.pause = lambda seconds: None
+    return broadcaster
+
+
+def test_retry_after_is_not_an_attempt(monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_MAX_RETRIES", 2)
+    bot = FakeBot([RetryAfter(0), RetryAfter(0), RetryAfter(0), NetworkError("reset")])
+    assert asyncio.run(_broadcaster(bot)._send(1, "hi"))
+    assert bot.sent == [(1, "hi")]
+
+
+def test_network_errors_use_up_attempts(monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_MAX_RETRIES", 2)
+    sleep = asyncio.sleep
+    monkeypatch.setattr(broadcast.asyncio, "sleep", lambda seconds: sleep(0))
+    bot = FakeBot([NetworkError("reset"), NetworkError("reset")])
+    assert not asyncio.run(_broadcaster(bot)._send(1, "hi"))
+
+
+def test_traffic_includes_other_workers():
+    storage = MemoryStorage()
+    storage.save_reply_rate("worker-1", 4.0)
+    traffic = InteractiveTraffic()
+    traffic.record(2)
+
+    async def share_once():
+        task = asyncio.create_task(traffic.share(storage, "worker-0"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(share_once())
+    assert traffic.rate() == 6.0
+    assert storage.get_reply_rate(0, exclude="worker-1") == 2.0
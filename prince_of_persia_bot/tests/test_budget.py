@@ -0,0 +1,92 @@
+import pytest
+
+from budget import TokenBudget, BudgetExceeded, MIN_OUTPUT_TOKENS, estimate_prompt_tokens, today, token_cost
+from storage import MemoryStorage
+
+PROMPT = "salam" * 30  # 51 tokens by estimate
+
+
+def _budget(user_daily=1000, global_daily=10000, **kwargs):
+    kwargs.setdefault("max_output_tokens", 500)
+    kwargs.setdefault("cheap_model", "lite")
+    return TokenBudget(MemoryStorage(), user_daily=user_daily, global_daily=global_daily, low_fraction=0.2,
+                       model="pro", **kwargs)
+
+
+def _use(budget, user_id, tokens):
+    budget.storage.add_token_usage(today(), user_id, "pro", tokens, 0)
+
+
+def test_plan_with_room_left():
+    plan = _budget().plan("u1", PROMPT)
+    assert plan == ("pro", 500, False)
+
+
+def test_user_budget_exceeded():
+    budget = _budget()
+    _use(budget, "u1", 1000 - estimate_prompt_tokens(PROMPT) - MIN_OUTPUT_TOKENS + 1)
+    with pytest.raises(BudgetExceeded) as exc_info:
+        budget.plan("u1", PROMPT)
+    assert exc_info.value.scope == "user"
+    assert budget.plan("u2", PROMPT).model == "pro"
+
+
+def test_global_budget_exceeded():
+    budget = _budget(global_daily=2000)
+    _use(budget, None, 1990)
+    with pytest.raises(BudgetExceeded) as exc_info:
+        budget.plan("u1", PROMPT)
+    assert exc_info.value.scope == "global"
+    with pytest.raises(BudgetExceeded):
+        budget.plan(None, PROMPT)
+
+
+def test_cheap_model_below_low_fraction():
+    budget = _budget()
+    _use(budget, "u1", 790)
+    assert budget.plan("u1", PROMPT).model == "pro"
+    _use(budget, "u1", 20)  # 190 of 1000 left
+    plan = budget.plan("u1", PROMPT)
+    assert plan.model == "lite" and plan.reduced
+    assert budget.plan("u2", PROMPT) == ("pro", 500, False)
+
+
+def test_cheap_model_can_be_disabled():
+    budget = _budget(cheap_model=None)
+    _use(budget, "u1", 850)
+    plan = budget.plan("u1", PROMPT)
+    assert plan.model == "pro" and plan.reduced
+
+
+def test_output_capped_at_tokens_left():
+    budget = _budget()
+    _use(budget, "u1", 700)
+    assert budget.plan("u1", PROMPT).max_output_tokens == 300 - estimate_prompt_tokens(PROMPT)
+    _use(budget, None, 9000)
+    assert budget.plan("u2", PROMPT).max_output_tokens == 10000 - 700 - 9000 - estimate_prompt_tokens(PROMPT)
+
+
+def test_no_limits():
+    budget = _budget(user_daily=0, global_daily=0)
+    _use(budget, "u1", 10 ** 9)
+    assert budget.remaining("u1") == (None, None)
+    assert budget.plan("u1", PROMPT) == ("pro", 500, False)
+
+
+def test_no_limits_and_no_output_cap():
+    assert _budget(user_daily=0, global_daily=0, max_output_tokens=0).plan("u1", PROMPT).max_output_tokens == 0
+    assert _budget(max_output_tokens=0).plan("u1", PROMPT).max_output_tokens == 1000 - estimate_prompt_tokens(PROMPT)
+
+
+def test_record_counts_towards_both_budgets():
+    budget = _budget()
+    budget.record("u1", "pro", 10, 20)
+    budget.record(None, "pro", 5, 5)
+    assert budget.remaining("u1") == (970, 9960)
+
+
+def test_token_cost(monkeypatch):
+    import budget as budget_module
+    monkeypatch.setattr(budget_module, "MODEL_PRICES", {"pro": (1.0, 4.0)})
+    assert token_cost("pro", 1_000_000, 500_000) == 3.0
+    assert token_cost("unknown", 1_000_000, 1_000_000) == 0.0
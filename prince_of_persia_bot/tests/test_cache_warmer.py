@@ -0,0 +1,40 @@
+import time
+import asyncio
+import datetime
+
+from cache_warmer import ResponseCache, CacheWarmer, normalize_question
+from storage import MemoryStorage
+
+
+def test_normalize_question():
+    assert normalize_question("  سلام   دنيا؟ ") == normalize_question("سلام دنیا")
+    assert normalize_question("Hello World!") == "hello world"
+
+
+def _ask(storage, text, times):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    storage.add_messages_many([dict(user_id="u1", text=text, enhanced_text=None, gemini_response=None,
+                                    deepseek_response=None, response_text=None, timestamp=now,
+                                    response_timestamp=now)] * times)
+
+
+def test_run_without_refresh_keeps_local_tier_bounded():
+    storage = MemoryStorage()
+    cache = ResponseCache(storage)
+    fetched = []
+    warmer = CacheWarmer(cache, fetched.append, min_asks=1)
+    cache._local["old"] = ("answer", time.time() - 1)
+    cache._asks["stale"] = 100
+    cache._window_started = time.time() - 10 * 24 * 3600
+    _ask(storage, "salam", 3)
+
+    async def run_briefly():
+        task = asyncio.create_task(warmer.run(refresh=False, refresh_interval=0.01, mine_interval=0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run_briefly())
+    assert "old" not in cache._local
+    assert dict(cache._asks) == {"salam": 3}
+    assert time.time() - cache._window_started < warmer.window_hours * 3600 + 60
+    assert fetched == []
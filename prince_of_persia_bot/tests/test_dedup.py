@@ -0,0 +1,64 @@
+import dedup
+from dedup import UpdateDeduplicator, UPDATE_ID_RESET_SECONDS
+from storage import MemoryStorage
+
+
+def test_floor_rises_as_ids_leave_the_window():
+    deduplicator = UpdateDeduplicator(MemoryStorage(), window=3)
+    for update_id in (1, 2, 3, 4, 5):
+        assert not deduplicator.is_duplicate(update_id)
+    assert deduplicator.floor == 2
+    assert deduplicator.is_duplicate(1)
+    assert deduplicator.is_duplicate(2)
+    assert deduplicator.is_duplicate(5)
+    assert deduplicator.duplicates == 3
+
+
+def test_out_of_order_updates_inside_the_window():
+    deduplicator = UpdateDeduplicator(MemoryStorage(), window=10)
+    assert not deduplicator.is_duplicate(10)
+    assert not deduplicator.is_duplicate(8)
+    assert not deduplicator.is_duplicate(9)
+    assert deduplicator.is_duplicate(8)
+    assert deduplicator.high_water_mark == 10
+
+
+def test_callback_query_duplicates():
+    deduplicator = UpdateDeduplicator(MemoryStorage())
+    assert not deduplicator.is_duplicate(1, callback_query_id="cb-1")
+    # The same button press redelivered under a new update id.
+    assert deduplicator.is_duplicate(2, callback_query_id="cb-1")
+    assert not deduplicator.is_duplicate(3, callback_query_id="cb-2")
+
+
+def test_high_water_mark_survives_a_restart():
+    storage = MemoryStorage()
+    deduplicator = UpdateDeduplicator(storage, save_seconds=3600)
+    for update_id in (100, 101, 102):
+        deduplicator.is_duplicate(update_id)
+    assert storage.get_update_watermark("telegram") is None
+    deduplicator.save()
+    assert storage.get_update_watermark("telegram")[0] == 102
+
+    restarted = UpdateDeduplicator(storage)
+    assert restarted.is_duplicate(101)
+    assert restarted.is_duplicate(102)
+    assert not restarted.is_duplicate(103)
+
+
+def test_high_water_mark_saved_periodically():
+    storage = MemoryStorage()
+    deduplicator = UpdateDeduplicator(storage, save_seconds=0)
+    deduplicator.is_duplicate(7)
+    assert storage.get_update_watermark("telegram")[0] == 7
+
+
+def test_old_high_water_mark_is_ignored(monkeypatch):
+    storage = MemoryStorage()
+    storage.save_update_watermark("telegram", 500)
+    saved_at = storage.get_update_watermark("telegram")[1]
+    monkeypatch.setattr(dedup.time, "time", lambda: saved_at + UPDATE_ID_RESET_SECONDS + 1)
+    # Telegram may have started over with random, lower update ids.
+    deduplicator = UpdateDeduplicator(storage)
+    assert deduplicator.floor == 0
+    assert not deduplicator.is_duplicate(3)
@@ -0,0 +1,27 @@
+import requests
+
+import gemini_api
+
+
+class FakeSession:
+    def __init__(self, error=None):
+        self.error = error
+        self.kwargs = None
+
+    def post(self, url, **kwargs):
+        self.kwargs = kwargs
+        raise self.error
+
+
+def test_calls_time_out(monkeypatch):
+    session = FakeSession(requests.exceptions.Timeout("read timed out"))
+    monkeypatch.setattr(gemini_api, "GEMINI_API_KEY", "key")
+    monkeypatch.setattr(gemini_api, "get_session", lambda: session)
+    assert gemini_api.get_gemini_response("salam", max_output_tokens=100) is None
+    assert session.kwargs["timeout"] == gemini_api.GEMINI_TIMEOUT_SECONDS
+    assert session.kwargs["json"]["generationConfig"] == {"maxOutputTokens": 100}
+
+
+def test_extract_usage_counts_thinking_as_output():
+    data = {"usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 20, "thoughtsTokenCount": 5}}
+    assert gemini_api.extract_usage(data) == (10, 25)
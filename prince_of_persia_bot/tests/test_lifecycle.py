@@ -0,0 +1,44 @@
+import asyncio
+
+from lifecycle import Lifecycle
+
+
+def test_stop_background_waits_for_cleanup():
+    lifecycle = Lifecycle()
+    cleaned = []
+
+    async def background():
+        try:
+            await asyncio.sleep(60)
+        finally:
+            await asyncio.sleep(0)
+            cleaned.append(True)
+
+    async def main():
+        lifecycle.add_background(asyncio.create_task(background()))
+        await asyncio.sleep(0)
+        await lifecycle.stop_background()
+
+    asyncio.run(main())
+    assert cleaned == [True]
+
+
+def test_shutdown_drains_then_cancels():
+    lifecycle = Lifecycle(drain_seconds=0.05)
+    finished = []
+
+    async def handler(seconds):
+        with lifecycle.track():
+            await asyncio.sleep(seconds)
+            finished.append(seconds)
+
+    async def main():
+        tasks = [asyncio.create_task(handler(0.01)), asyncio.create_task(handler(60))]
+        await asyncio.sleep(0)
+        lifecycle.shutdown()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert finished == [0.01]
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert lifecycle.in_flight() == 0
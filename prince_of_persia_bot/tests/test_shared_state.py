@@ -0,0 +1,102 @@
+import multiprocessing
+
+import pytest
+
+from shared_state import InMemorySharedState, SQLiteSharedState
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+    if request.param == "memory":
+        state = InMemorySharedState()
+    else:
+        state = SQLiteSharedState(str(tmp_path / "bot.db"))
+    yield state
+    state.close()
+
+
+def _add_pending_payment(state, payment_id, user_id):
+    if isinstance(state, SQLiteSharedState):
+        state._connection().execute(
+            "INSERT INTO Payment (payment_id, user_id, plan_id, amount, payment_status) VALUES (?, ?, 1, 10, 'pending')",
+            (payment_id, user_id)
+        )
+    else:
+        state._payments[payment_id] = {"user_id": user_id, "payment_status": "pending"}
+
+
+def test_reserve_and_refund_credit(state):
+    state.add_user("u1", "1", "Telegram", initial_credits=2)
+    assert state.reserve_credit("u1")
+    assert state.reserve_credit("u1")
+    assert not state.reserve_credit("u1")
+    assert state.get_user_credits("u1") == 0
+    state.refund_credit("u1")
+    assert state.get_user_credits("u1") == 1
+    assert not state.reserve_credit("u1", amount=2)
+    assert state.get_user_credits("u1") == 1
+
+
+def test_reserve_credit_unknown_user(state):
+    assert not state.reserve_credit("missing")
+    assert state.get_user_credits("missing") is None
+
+
+def test_add_user_keeps_existing_credits(state):
+    state.add_user("u1", "1", "Telegram", initial_credits=5)
+    state.reserve_credit("u1")
+    state.add_user("u1", "1", "Telegram", initial_credits=5)
+    assert state.get_user_credits("u1") == 4
+
+
+def test_check_rate_limit(state):
+    assert state.check_rate_limit("u1", 60)
+    assert not state.check_rate_limit("u1", 60)
+    assert state.check_rate_limit("u2", 60)
+    assert state.check_rate_limit("u1", 0)
+
+
+def test_complete_payment_credits_once(state):
+    state.add_user("u1", "1", "Telegram", initial_credits=0)
+    _add_pending_payment(state, 7, "u1")
+    assert state.complete_payment(7, 50)
+    assert not state.complete_payment(7, 50)
+    assert state.get_user_credits("u1") == 50
+
+
+def test_complete_unknown_payment(state):
+    assert not state.complete_payment(404, 50)
+
+
+def _reserve_many(database_file, user_id, attempts):
+    state = SQLiteSharedState(database_file)
+    try:
+        return sum(state.reserve_credit(user_id) for _ in range(attempts))
+    finally:
+        state.close()
+
+
+def test_sqlite_reserve_credit_race(tmp_path):
+    database_file = str(tmp_path / "bot.db")
+    state = SQLiteSharedState(database_file)
+    state.add_user("u1", "1", "Telegram", initial_credits=100)
+    # Spawned like the bot workers, so every process has its own connection.
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        reserved = pool.starmap(_reserve_many, [(database_file, "u1", 40)] * 4)
+    assert sum(reserved) == 100
+    assert state.get_user_credits("u1") == 0
+    state.close()
+
+
+def test_workers_refuse_memory_backend(monkeypatch):
+    import workers
+    monkeypatch.setattr(workers, "STORAGE_BACKEND", "memory")
+    with pytest.raises(ValueError):
+        workers.main(2)
+
+
+def test_clear_rate_limit(state):
+    assert state.check_rate_limit("u1", 60)
+    state.clear_rate_limit("u1")
+    assert state.check_rate_limit("u1", 60)
+    state.clear_rate_limit("missing")
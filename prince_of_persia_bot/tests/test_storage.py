@@ -0,0 +1,136 @@
+import time
+import datetime
+
+import pytest
+
+from storage import MemoryStorage, SQLiteStorage, AlreadyJournaled
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(str(tmp_path / "bot.db"))
+    yield storage
+    storage.close()
+
+
+def _message(user_id, text, timestamp, **fields):
+    return dict(user_id=user_id, text=text, enhanced_text=None, gemini_response="answer", deepseek_response=None,
+                response_text="answer", timestamp=timestamp, response_timestamp=timestamp, **fields)
+
+
+def test_users(storage):
+    storage.add_user("u1", "1", "Telegram", username="ali", initial_credits=3)
+    storage.update_user_phone_number("u1", "+989120000000")
+    storage.add_credits_to_user("u1", 2)
+    user = storage.get_user("u1")
+    assert user[:6] == ("u1", "1", "Telegram", "ali", "+989120000000", 5)
+    assert storage.get_user_phone_number("u1") == "+989120000000"
+    assert storage.get_users_many(["u1", "missing"]).keys() == {"u1"}
+    assert storage.get_user("missing") is None
+
+
+def test_plans_and_payments(storage):
+    storage.add_user("u1", "1", "Telegram", initial_credits=0)
+    plan_id = storage.add_plan("Basic", 10.0, 100, "100 questions")
+    assert storage.get_plan_by_id(plan_id)[1:4] == ("Basic", 10.0, 100)
+    assert len(storage.get_all_plans()) == 1
+
+    payment_id = storage.add_payment("u1", plan_id, 10.0, authority="A1")
+    assert storage.get_payment_details(payment_id)[:5] == (payment_id, "u1", plan_id, 10.0, "pending")
+    assert not storage.has_completed_payment("u1")
+    assert storage.complete_payment(payment_id, 100)
+    assert not storage.complete_payment(payment_id, 100)
+    assert storage.has_completed_payment("u1")
+    assert storage.get_user_credits("u1") == 100
+
+    storage.add_transaction(payment_id, "T1", 10.0, "100")
+    assert storage.get_transaction(payment_id)[:4] == (payment_id, "T1", 10.0, "100")
+
+
+def test_messages(storage):
+    now = datetime.datetime.now()
+    earlier = (now - datetime.timedelta(hours=1)).isoformat()
+    storage.add_message("u1", "salam", None, "answer", None, "answer", earlier, earlier)
+    storage.add_messages_many([
+        _message("u1", "salam", now.isoformat(), cache_hit=True),
+        _message("u2", "khodafez", now.isoformat(), prompt_tokens=10, output_tokens=20, model="m"),
+    ])
+    assert storage.get_last_message_timestamp("u1") == now.isoformat()
+    assert storage.get_last_message_timestamp("missing") is None
+    assert storage.get_popular_questions(earlier, 1) == [("salam", 2)]
+
+
+def test_pending_requests(storage):
+    storage.add_user("u1", "1", "Telegram", initial_credits=1)
+    asked_at = datetime.datetime.now().isoformat()
+    assert storage.reserve_request("r1", "u1", 1, "salam", asked_at)
+    assert not storage.reserve_request("r2", "u1", 1, "salam", asked_at)
+    assert storage.get_unfinished_requests(time.time() + 1)[0][0] == "r1"
+    storage.add_credits_to_user("u1", 1)
+    with pytest.raises(AlreadyJournaled):
+        storage.reserve_request("r1", "u1", 1, "salam", asked_at)
+    assert storage.get_user_credits("u1") == 1
+    storage.add_credits_to_user("u1", -1)
+
+    storage.release_request("r1", keep=True)
+    assert storage.get_user_credits("u1") == 1
+    assert storage.get_unfinished_requests(time.time() + 1) == [("r1", "u1", 1, "salam", asked_at, "interrupted")]
+    storage.release_request("r1")
+    assert storage.get_unfinished_requests(time.time() + 1) == []
+
+    assert storage.reserve_request("r3", "u1", 1, "salam", asked_at)
+    storage.settle_request("r3", _message("u1", "salam", asked_at))
+    storage.release_request("r3")
+    assert storage.get_user_credits("u1") == 0
+    assert storage.get_last_message_timestamp("u1") == asked_at
+
+
+def test_token_usage(storage):
+    storage.add_token_usage("2026-01-01", "u1", "pro", 40, 60)
+    storage.add_token_usage("2026-01-01", "u2", "pro", 20, 30)
+    storage.add_token_usage("2026-01-01", None, "lite", 5, 20)
+    assert storage.get_token_usage("2026-01-01", "u1") == (100, 175)
+    assert storage.get_token_usage("2026-01-01") == (0, 175)
+    assert storage.get_token_usage("2026-01-02", "u1") == (0, 0)
+    assert storage.get_model_usage("2026-01-01") == [("lite", 1, 5, 20), ("pro", 2, 60, 90)]
+    assert storage.get_model_usage("2026-01-02") == []
+
+
+def test_update_watermark(storage):
+    assert storage.get_update_watermark("telegram") is None
+    storage.save_update_watermark("telegram", 10)
+    storage.save_update_watermark("telegram", 12)
+    update_id, saved_at = storage.get_update_watermark("telegram")
+    assert update_id == 12 and saved_at <= time.time()
+
+
+def test_cache(storage):
+    storage.store_cached_response("q", "a", "gemini", expires_in_seconds=60)
+    assert storage.get_cached_response("q", "gemini") == "a"
+    assert storage.get_cache_entry("q", "gemini")[0] == "a"
+    storage.store_cached_response("old", "a", "gemini", expires_in_seconds=-1)
+    assert storage.get_cached_response("old", "gemini") is None
+    storage.delete_expired_cache()
+    assert storage.get_cache_entry("old", "gemini") is None
+
+
+def test_broadcasts(storage):
+    broadcast_id = storage.create_broadcast("news")
+    assert storage.claim_broadcast(broadcast_id)
+    assert not storage.claim_broadcast(broadcast_id)
+    storage.save_broadcast_progress(broadcast_id, "running", "u5", 5, 1)
+    assert storage.get_broadcast(broadcast_id) == (broadcast_id, "news", "running", "u5", 5, 1)
+    assert [b[0] for b in storage.get_unfinished_broadcasts()] == [broadcast_id]
+    storage.save_broadcast_progress(broadcast_id, "done", "u9", 9, 1)
+    assert storage.get_unfinished_broadcasts() == []
+
+
+def test_reply_rates(storage):
+    storage.save_reply_rate("worker-0", 2.0)
+    storage.save_reply_rate("worker-1", 3.0)
+    assert storage.get_reply_rate(time.time() - 5) == 5.0
+    assert storage.get_reply_rate(time.time() - 5, exclude="worker-0") == 3.0
+    assert storage.get_reply_rate(time.time() + 5) == 0
@@ -0,0 +1,91 @@
+import queue
+import threading
+
+import pytest
+import requests
+
+import workers
+
+
+class FakeResponse:
+    def __init__(self, result=None):
+        self.result = result
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"result": self.result}
+
+
+class FakeSession:
+    """deleteWebhook fails once; getUpdates returns one batch, then the poller is stopped."""
+
+    def __init__(self, stop_event, batch):
+        self.stop_event = stop_event
+        self.batch = batch
+        self.posts = 0
+        self.gets = []
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        if self.posts == 1:
+            raise requests.exceptions.ConnectionError("connection refused")
+        return FakeResponse()
+
+    def get(self, url, params=None, **kwargs):
+        self.gets.append(params)
+        if params["timeout"] == 0:
+            return FakeResponse([])
+        if len(self.gets) > 1:
+            self.stop_event.set()
+            return FakeResponse([])
+        return FakeResponse(self.batch)
+
+
+def test_webhook_deletion_is_retried(monkeypatch):
+    stop_event = threading.Event()
+    session = FakeSession(stop_event, [{"update_id": 5, "message": {"from": {"id": 1}}}])
+    monkeypatch.setattr(workers.requests, "Session", lambda: session)
+    monkeypatch.setattr(stop_event, "wait", lambda timeout=None: stop_event.is_set())
+    queues = [queue.Queue()]
+    workers.poll_updates(queues, stop_event)
+    assert session.posts == 2
+    assert queues[0].get_nowait()["update_id"] == 5
+    assert session.gets[-1] == {"timeout": 0, "offset": 6, "limit": 1}
+
+
+def test_unexpected_errors_are_logged(monkeypatch, caplog):
+    stop_event = threading.Event()
+    session = FakeSession(stop_event, [{"no_update_id": True}])
+    session.posts = 1
+    monkeypatch.setattr(workers.requests, "Session", lambda: session)
+    workers.poll_updates([queue.Queue()], stop_event)
+    assert "Update poller crashed" in caplog.text
+    assert not stop_event.is_set()
+
+
+class FakeProcess:
+    def __init__(self, target, args, name):
+        self.name = name
+
+    def start(self):
+        pass
+
+    def join(self, timeout=None):
+        pass
+
+
+class FakeContext:
+    Queue = staticmethod(lambda size: queue.Queue(size))
+    Event = threading.Event
+    Process = FakeProcess
+
+
+def test_main_fails_when_the_poller_dies(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(workers.multiprocessing, "get_context", lambda method: FakeContext)
+    monkeypatch.setattr(workers, "poll_updates", lambda queues, stop_event, dedup: None)
+    monkeypatch.setattr(workers.signal, "signal", lambda signum, handler: None)
+    with pytest.raises(RuntimeError):
+        workers.main(2)
@@ -0,0 +1,210 @@
+import os
+import zlib
+import time
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+import requests
+
+from config import TELEGRAM_API_TOKEN, PROXY_URL, BOT_WORKERS, WORKER_QUEUE_SIZE, STORAGE_BACKEND
+from readiness import mark_ready, mark_not_ready
+from storage import get_storage
+from dedup import UpdateDeduplicator
+
+POLL_TIMEOUT_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+# Keys of the update payload that carry the sender, in the order we look for them.
+_USER_UPDATE_FIELDS = ("message", "edited_message", "callback_query", "inline_query", "my_chat_member", "pre_checkout_query")
+
+
+def partition_key(update_data):
+    """Returns the user id an update belongs to, falling back to the update id for anonymous updates."""
+    for field in _USER_UPDATE_FIELDS:
+        payload = update_data.get(field)
+        if payload and payload.get("from"):
+            return payload["from"]["id"]
+    return update_data.get("update_id")
+
+
+def partition_for(key, num_workers):
+    """Maps a partition key to a worker index. Stable across processes, unlike hash()."""
+    return zlib.crc32(str(key).encode()) % num_workers
+
+
+def poll_updates(queues, stop_event, dedup=None):
+    """
+    Long-polls Telegram and routes every update to the queue of the worker that owns its user.
+
+    Updates from one user always land on the same worker, in the order Telegram sent them.
+    The worker handles its updates concurrently though (concurrent_updates in bot.py), so
+    a user's later update can finish before an earlier one; credits and rate limits are
+    updated atomically in storage and don't depend on the order. Updates that `dedup` has
+    seen before are dropped here. Network errors are retried; anything else is logged and
+    ends the thread, which main() turns into a failed exit.
+    """
+    try:
+        _poll(queues, stop_event, dedup)
+    except Exception:
+        logger.exception("Update poller crashed")
+
+
+def _poll(queues, stop_event, dedup):
+    base_url = f"https://api.telegram.org/bot{TELEGRAM_API_TOKEN}"
+    proxies = {"http": PROXY_URL, "https": PROXY_URL} if PROXY_URL else None
+    session = requests.Session()
+    webhook_deleted = False
+    offset = None
+    while not stop_event.is_set():
+        try:
+            if not webhook_deleted:
+                # getUpdates is refused while a webhook is set.
+                session.post(f"{base_url}/deleteWebhook", proxies=proxies, timeout=10).raise_for_status()
+                webhook_deleted = True
+            response = session.get(
+                f"{base_url}/getUpdates",
+                params={"timeout": POLL_TIMEOUT_SECONDS, "offset": offset},
+                proxies=proxies,
+                timeout=POLL_TIMEOUT_SECONDS + 10,
+            )
+            response.raise_for_status()
+            updates = response.json().get("result", [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error polling updates: {e}")
+            stop_event.wait(1)
+            continue
+        if stop_event.is_set():
+            # Stopped during the long poll: leave this batch unconfirmed for the next run.
+            break
+        for update_data in updates:
+            offset = update_data["update_id"] + 1
+            callback_query_id = (update_data.get("callback_query") or {}).get("id")
+            if dedup and dedup.is_duplicate(update_data["update_id"], callback_query_id):
+                logger.info(f"Dropped duplicate update {update_data['update_id']}")
+                continue
+            index = partition_for(partition_key(update_data), len(queues))
+            queues[index].put(update_data)
+    if offset is not None:
+        # Confirm what was handed to the workers, or Telegram sends it again after the restart.
+        try:
+            session.get(f"{base_url}/getUpdates", params={"timeout": 0, "offset": offset, "limit": 1},
+                        proxies=proxies, timeout=10)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error confirming updates: {e}")
+
+
+async def _worker_loop(index, queue, ready_event, started_at):
+    # Imported here so that each spawned worker builds its own application and state connections.
+    from telegram import Update
+    import bot
+
+    # Requests journaled before the dispatcher started are the previous run's, whichever worker boots first.
+    bot.lifecycle.started_at = started_at
+    application = bot.build_application(with_updater=False)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        # Broadcasts run in worker 0 but have to yield to the replies of every worker.
+        bot.lifecycle.add_background(asyncio.create_task(bot.interactive_traffic.share(bot.storage, f"worker-{index}")))
+        if index == 0:
+            await bot.start_background_tasks(application)
+        else:
+            bot.cache_warmer.preload()
+            # Worker 0 refreshes the shared cache; the others only keep their local tier in shape.
+            bot.lifecycle.add_background(asyncio.create_task(bot.cache_warmer.run(refresh=False)))
+        ready_event.set()
+        logger.info(f"Worker {index} started (pid {os.getpid()})")
+        while True:
+            update_data = await loop.run_in_executor(None, queue.get)
+            if update_data is None:
+                break
+            await application.update_queue.put(Update.de_json(update_data, application.bot))
+        # Everything queued before the sentinel still gets handled, within the drain deadline.
+        bot.lifecycle.shutdown()
+        await application.stop()
+        await bot.lifecycle.stop_background()
+    bot.storage.close()
+    logger.info(f"Worker {index} stopped")
+
+
+def run_worker(index, queue, ready_event, started_at):
+    # The dispatcher decides when workers stop, by sending them None.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(_worker_loop(index, queue, ready_event, started_at))
+
+
+def _report_ready(ready_events, stop_event):
+    for event in ready_events:
+        while not event.wait(1):
+            if stop_event.is_set():
+                return
+    if not stop_event.is_set():
+        mark_ready()
+        logger.info(f"All {len(ready_events)} workers ready")
+
+
+def main(num_workers=BOT_WORKERS):
+    """Runs one polling dispatcher in this process and `num_workers` bot worker processes."""
+    if STORAGE_BACKEND == "memory" and num_workers > 1:
+        # Every worker would get its own empty copy of credits, payments and the cache.
+        raise ValueError("STORAGE_BACKEND=memory can't be shared between workers; use sqlite or BOT_WORKERS=1")
+    # Opening storage here also migrates the schema before any worker starts.
+    storage = get_storage()
+    dedup = UpdateDeduplicator(storage)
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(num_workers)]
+    ready_events = [ctx.Event() for _ in range(num_workers)]
+    started_at = time.time()
+    workers = [
+        ctx.Process(target=run_worker, args=(index, queue, ready_events[index], started_at), name=f"bot-worker-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    # Updates that arrive before a worker is up just wait in its queue; this only decides
+    # when the bot as a whole reports ready.
+    threading.Thread(target=_report_ready, args=(ready_events, stop_event), daemon=True).start()
+    # Polling runs in its own thread so a stop signal doesn't have to wait for the long poll.
+    poller = threading.Thread(target=poll_updates, args=(queues, stop_event, dedup), name="poller", daemon=True)
+    poller.start()
+    poller_failed = False
+    try:
+        while not stop_event.wait(1):
+            if not poller.is_alive():
+                poller_failed = not stop_event.is_set()
+                break
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        mark_not_ready()
+        # Give the poller a moment to confirm what it queued; it queues nothing more after the stop.
+        poller.join(2)
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        dedup.save()
+        storage.close()
+    if poller_failed:
+        # A non-zero exit lets a process manager with restart-on-failure bring the bot back.
+        raise RuntimeError("Update poller stopped unexpectedly")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    main()
@@ -1,12 +1,7 @@
-import requests
 import json
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
-
-# TODO: Get ZarinPal Merchant ID from environment variables or a secure location
-ZARINPAL_MERCHANT_ID = os.getenv("ZARINPAL_MERCHANT_ID", "YOUR_ZARINPAL_MERCHANT_ID") # Placeholder
+from config import ZARINPAL_MERCHANT_ID
+from http_client import get_session
 
 # ZarinPal API Endpoints (verify with ZarinPal documentation)
 ZARINPAL_REQUEST_URL = "https://api.zarinpal.com/pg/v4/payment/request.json"
@@ -43,8 +38,10 @@ def create_payment_request(amount, description, callback_url, metadata=None):
         "Accept": "application/json"
     }
 
+    import requests
+
     try:
-        response = requests.post(ZARINPAL_REQUEST_URL, data=json.dumps(payload), headers=headers)
+        response = get_session().post(ZARINPAL_REQUEST_URL, data=json.dumps(payload), headers=headers)
         response.raise_for_status() # Raise an exception for bad status codes
         response_data = response.json()
 
@@ -84,8 +81,10 @@ def verify_payment(authority, amount):
         "Accept": "application/json"
     }
 
+    import requests
+
     try:
-        response = requests.post(ZARINPAL_VERIFY_URL, data=json.dumps(payload), headers=headers)
+        response = get_session().post(ZARINPAL_VERIFY_URL, data=json.dumps(payload), headers=headers)
         response.raise_for_status() # Raise an exception for bad status codes
         response_data = response.json()
 